@@ -0,0 +1,408 @@
+import gc
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+from click import argument, option
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_db_tool():
+    # db-tool.py 不是合法的模块名, 通过文件路径加载
+    spec = importlib.util.spec_from_file_location('db_tool', os.path.join(SCRIPT_DIR, 'db-tool.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+dbt = load_db_tool()
+
+# (MySQL 列类型, PostgreSQL data_type, 长度, 小数位数)
+COLUMN_TYPES = [
+    ('bigint(20)', 'bigint', None, None),
+    ('int(11)', 'integer', None, None),
+    ('varchar(64)', 'character varying', 64, None),
+    ('varchar(255)', 'character varying', 255, None),
+    ('decimal(10,2)', 'numeric', 10, 2),
+    ('datetime', 'timestamp without time zone', None, None),
+    ('text', 'text', None, None),
+    ('tinyint(1)', 'smallint', None, None),
+]
+
+
+def synth_schema(tables, columns, seed=0):
+    """
+    生成 tables 张表, 每张表 columns 列的数据库结构, 第一列为主键, 相同参数生成的结构相同
+    """
+    rnd = random.Random(seed)
+    schema = []
+    for t in range(tables):
+        name = f"t{t:05d}_{rnd.choice(['user', 'order', 'item', 'log', 'config'])}"
+        cols = []
+        for c in range(columns):
+            mysql_type, pg_type, length, decimal = COLUMN_TYPES[0] if c == 0 else rnd.choice(COLUMN_TYPES)
+            cols.append({'name': 'id' if c == 0 else f"col_{c}", 'mysql_type': mysql_type, 'pg_type': pg_type,
+                         'length': length, 'decimal': decimal, 'nullable': c != 0 and rnd.random() < 0.7,
+                         'default': rnd.choice([None, None, '0', "''"]) if c else None,
+                         'comment': f"{name} 的第 {c} 列", 'primary_key': c == 0})
+        schema.append({'name': name, 'comment': f"测试表 {t}", 'columns': cols})
+    return schema
+
+
+def mysql_results(schema):
+    """
+    MySQL 各条元数据查询对应的结果集, 逐表查询的结果按表名保存
+    """
+    results = {
+        'show tables': [{'Tables_in_bench': t['name']} for t in schema],
+        'show table status': [{'Name': t['name'], 'Comment': t['comment']} for t in schema],
+        'tables': [{'table_name': t['name'], 'table_comment': t['comment']} for t in schema],
+        'statistics': [{'table_name': t['name'], 'column_name': c['name']}
+                       for t in schema for c in t['columns'] if c['primary_key']],
+        'columns': [{'table_name': t['name'], 'column_name': c['name'], 'column_type': c['mysql_type'],
+                     'is_nullable': 'YES' if c['nullable'] else 'NO', 'column_default': c['default'],
+                     'column_comment': c['comment']}
+                    for t in schema for c in t['columns']],
+        'show full columns': {},
+        'show index': {},
+    }
+    for t in schema:
+        results['show full columns'][t['name']] = [
+            {'Field': c['name'], 'Type': c['mysql_type'], 'Collation': None, 'Null': 'YES' if c['nullable'] else 'NO',
+             'Key': 'PRI' if c['primary_key'] else '', 'Default': c['default'], 'Extra': '',
+             'Privileges': 'select,insert,update,references', 'Comment': c['comment']}
+            for c in t['columns']]
+        results['show index'][t['name']] = [
+            {'Table': t['name'], 'Non_unique': 0, 'Key_name': 'PRIMARY', 'Seq_in_index': 1, 'Column_name': c['name']}
+            for c in t['columns'] if c['primary_key']]
+    return results
+
+
+def pg_results(schema):
+    """
+    PostgreSQL 各条元数据查询对应的结果集, 逐表查询的结果按表名保存
+    """
+    results = {
+        'tables': [{'table_name': t['name'], 'table_comment': t['comment']} for t in schema],
+        'columns_bulk': [{'table_name': t['name'], 'column_name': c['name'], 'data_type': c['pg_type'],
+                          'character_maximum_length': c['length'] if c['pg_type'] == 'character varying' else None,
+                          'numeric_precision': c['length'] if c['pg_type'] == 'numeric' else None,
+                          'numeric_scale': c['decimal'], 'nullable': c['nullable'], 'column_default': c['default'],
+                          'comment': c['comment'], 'primary_key': c['primary_key']}
+                         for t in schema for c in t['columns']],
+        'columns': {},
+    }
+    for t in schema:
+        results['columns'][t['name']] = [
+            {'table_name': t['name'], 'column_name': c['name'], 'data_type': c['pg_type'], 'length': c['length'],
+             'decimal': c['decimal'], 'nullable': c['nullable'], 'column_default': c['default'],
+             'comment': c['comment'], 'primary_key': c['primary_key']}
+            for c in t['columns']]
+    return results
+
+
+class FakeCursor:
+    """
+    按 SQL 语句回放预先生成的结果集的 DB-API 游标
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.rows = []
+        self.position = 0
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def execute(self, sql, params=None):
+        self.rows = self.lookup(' '.join(sql.split()))
+        self.position = 0
+        self.rowcount = len(self.rows)
+        return self.rowcount
+
+    def lookup(self, sql):
+        r = self.results
+        if sql.startswith('show full columns from '):
+            return r['show full columns'][sql[len('show full columns from '):]]
+        if sql.startswith('show index from '):
+            return r['show index'][sql[len('show index from '):]]
+        if sql in ('show tables', 'show table status'):
+            return r[sql]
+        if 'information_schema.STATISTICS' in sql:
+            return r['statistics']
+        if 'information_schema.COLUMNS' in sql:
+            return r['columns']
+        if 'information_schema.TABLES' in sql:
+            return r['tables']
+        if sql.startswith('SELECT current_schema()'):
+            return [{'current_schema': 'public'}]
+        if sql.startswith('SET '):
+            return []
+        if 'FROM pg_attribute a' in sql:
+            return r['columns_bulk']
+        m = re.search(r"c\.table_name = '([^']*)'", sql)
+        if 'information_schema.columns c' in sql and m:
+            return r['columns'][m.group(1)]
+        if 'obj_description(c.oid) AS table_comment' in sql:
+            return r['tables']
+        raise NotImplementedError(f"没有录制的查询: {sql[:120]}")
+
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchmany(self, size=1000):
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+
+class FakeConnection:
+
+    def __init__(self, results):
+        self.results = results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.results)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def build_db(schema):
+    return dbt.Database(name='bench', tables=[
+        dbt.Table(name=t['name'], comment=t['comment'], columns=[
+            dbt.Column(table=t['name'], name=c['name'], type=c['pg_type'], length=c['length'], decimal=c['decimal'],
+                       nullable=c['nullable'], default=c['default'] or '', comment=c['comment'],
+                       primary_key=c['primary_key'])
+            for c in t['columns']])
+        for t in schema])
+
+
+def prepare(scenario, schema):
+    """
+    返回 scenario 对应的无参数函数, 结果集和数据库结构在计时之前准备好
+    """
+    if scenario.startswith('mysql'):
+        results = mysql_results(schema)
+        dbt.connect_mysql = lambda *args, **kwargs: FakeConnection(results)
+        bulk = scenario == 'mysql-bulk'
+        return lambda: dbt.read_mysql_db('bench', 3306, 'u', 'p', 'bench', None, (), (), bulk)
+
+    if scenario.startswith('pg'):
+        results = pg_results(schema)
+        dbt.connect_pg = lambda *args, **kwargs: FakeConnection(results)
+        bulk = scenario == 'pg-bulk'
+        return lambda: dbt.read_postgresql_db('bench', 5432, 'u', 'p', 'bench', 'public', (), (), bulk)
+
+    db = build_db(schema)
+
+    if scenario == 'docx':
+        template = os.path.join(SCRIPT_DIR, 'default.docx')
+        output = os.path.join(tempfile.gettempdir(), 'db-bench.docx')
+        return lambda: dbt.gen_file(template, output, db)
+
+    if scenario in ('markdown', 'html', 'json'):
+        output = os.path.join(tempfile.gettempdir(), 'db-bench' + dbt.DOC_FORMATS[scenario])
+        return lambda: dbt.gen_text_file(scenario, output, db)
+
+    if scenario == 'diff':
+        # 另一份结构中每 100 张表修改一列的类型
+        other = build_db(schema)
+        for table in other.tables[::100]:
+            table.columns[-1].type = 'text'
+        return lambda: dbt.diff_db(db, other)
+
+    return lambda: dbt.gen_er_diagram_text(db)
+
+
+SCENARIOS = ['mysql-bulk', 'mysql-tables', 'pg-bulk', 'pg-tables', 'docx', 'markdown', 'html', 'json', 'mermaid',
+             'diff']
+
+
+def measure(fn, repeat, memory):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        # tracemalloc 会明显拖慢执行, 单独运行一次只用于统计内存峰值
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return times, peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(ctx, param, value):
+    try:
+        return [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise click.BadParameter(f"需要逗号分隔的整数: {value}")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(name='run')
+@option('--tables', help='comma separated table counts', default='10,100,1000', show_default=True, callback=int_list)
+@option('--columns', help='comma separated column counts per table', default='10,50', show_default=True, callback=int_list)
+@option('--scenario', '-s', help='scenario to run, all if not specified', type=click.Choice(SCENARIOS), multiple=True)
+@option('--repeat', '-r', help='runs of each case, the minimum time is reported', type=click.IntRange(min=1), default=3, show_default=True)
+@option('--memory/--no-memory', help='measure peak memory with tracemalloc in an extra run', default=True, show_default=True)
+@option('--output', '-o', help='write results as JSON')
+def bench_run(tables, columns, scenario, repeat, memory, output):
+    """
+    使用生成的数据库结构测试读取和渲染的性能
+    """
+    results = []
+    click.echo(f"{'场景':<14}{'表':>8}{'列':>6}{'最短(秒)':>12}{'平均(秒)':>12}{'内存峰值(MB)':>14}")
+    for s in scenario or SCENARIOS:
+        for t in tables:
+            for c in columns:
+                fn = prepare(s, synth_schema(t, c))
+                times, peak = measure(fn, repeat, memory)
+                result = {'scenario': s, 'tables': t, 'columns': c, 'min': min(times),
+                          'mean': sum(times) / len(times), 'repeat': repeat, 'peak_memory': peak}
+                results.append(result)
+                click.echo(f"{s:<14}{t:>8}{c:>6}{result['min']:>12.4f}{result['mean']:>12.4f}"
+                           f"{'-' if peak is None else round(peak / 1024 / 1024, 1):>14}")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+
+# --help 时不应该加载的库
+STARTUP_FORBIDDEN = {
+    'db-tool.py': ['psycopg2', 'pymysql', 'docx', 'docxtpl', 'docxcompose', 'jinja2', 'lxml', 'survey'],
+    'git-tool.py': ['git', 'gitlab', 'prompt_toolkit'],
+}
+
+
+def imported_modules(script):
+    # -X importtime 在 stderr 中输出每个导入的模块
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(SCRIPT_DIR, script), '--help'],
+                            capture_output=True, text=True).stderr
+    return {line.rsplit('|', 1)[1].strip() for line in stderr.splitlines() if line.startswith('import time:')}
+
+
+@cli.command(name='startup')
+@option('--repeat', '-r', help='runs of each script, the minimum time is reported', type=click.IntRange(min=1), default=5, show_default=True)
+@option('--max-seconds', help='fail if --help takes longer than this', type=float, default=1.0, show_default=True)
+@option('--output', '-o', help='write results as JSON')
+@click.pass_context
+def bench_startup(ctx, repeat, max_seconds, output):
+    """
+    测试 --help 的启动时间, 并检查没有加载不需要的库
+    """
+    results = []
+    failed = False
+    for script, forbidden in STARTUP_FORBIDDEN.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, script), '--help'], capture_output=True, check=True)
+            times.append(time.perf_counter() - start)
+
+        loaded = sorted(m for m in imported_modules(script) if m.split('.')[0] in forbidden)
+        result = {'scenario': f"startup:{script}", 'tables': 0, 'columns': 0, 'min': min(times),
+                  'mean': sum(times) / len(times), 'repeat': repeat, 'peak_memory': None, 'loaded': loaded}
+        results.append(result)
+        click.echo(f"{script:<14}{result['min']:>10.3f} 秒" + (f"  加载了不需要的库: {', '.join(loaded)}" if loaded else ''))
+        if loaded or result['min'] > max_seconds:
+            failed = True
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command(name='compare')
+@argument('baseline', type=click.Path(exists=True))
+@argument('current', type=click.Path(exists=True))
+@option('--threshold', help='relative slowdown reported as regression', type=float, default=0.1, show_default=True)
+@option('--min-time', help='cases faster than this in both runs (seconds) are too noisy to be regressions', type=float, default=0.01, show_default=True)
+@click.pass_context
+def bench_compare(ctx, baseline, current, threshold, min_time):
+    """
+    比较两次 run 的结果, 有性能退化时返回 1
+    """
+    def load(path):
+        with open(path, encoding='utf-8') as f:
+            return {(r['scenario'], r['tables'], r['columns']): r for r in json.load(f)['results']}
+
+    old, new = load(baseline), load(current)
+    regressions = 0
+    click.echo(f"{'场景':<14}{'表':>8}{'列':>6}{'基准(秒)':>12}{'当前(秒)':>12}{'变化':>10}")
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]['min'] / old[key]['min'] - 1 if old[key]['min'] else 0
+        flag = ''
+        if ratio > threshold and new[key]['min'] >= min_time:
+            regressions += 1
+            flag = '  退化'
+        click.echo(f"{key[0]:<14}{key[1]:>8}{key[2]:>6}{old[key]['min']:>12.4f}{new[key]['min']:>12.4f}{ratio:>+10.1%}{flag}")
+
+    if regressions:
+        click.echo(f"{regressions} 项性能退化超过 {threshold:.0%}")
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,25 +1,48 @@
+import gzip
+import hashlib
+import html
+import io
+import json
 import os
 import re
-from dataclasses import dataclass
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
+from collections.abc import Sequence
+from dataclasses import astuple, dataclass, field, fields, replace
+from functools import lru_cache
+from operator import attrgetter
 
 import click
-import psycopg2
-import pymysql.cursors
-import survey
-from click import option
-from docxtpl import DocxTemplate
-from psycopg2.extras import RealDictCursor
+from click import argument, option
 
+import progress
+from progress import NO_PROGRESS, PROGRESS_MODES, Progress
 
-@dataclass
+# 数据库驱动、docxtpl、survey 等依赖在用到的函数中导入, 每个命令只加载自己需要的库, 保证 --help 等命令启动足够快
+
+
+def intern_str(value):
+    # 表名、列名、类型在大库中大量重复, 驻留后所有字段共用同一个字符串对象
+    return sys.intern(value) if type(value) is str else value
+
+
+@dataclass(slots=True)
 class Database:
     # 数据库名
     name: str
     # 表
     tables: list
+    # 外键, 只有生成 ER 图和快照时读取
+    foreign_keys: list = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class Table:
     # 表名
     name: str
@@ -27,9 +50,35 @@ class Table:
     comment: str
     # 列
     columns: list
-
-
-@dataclass
+    # 估算行数, 来自 information_schema.TABLES.TABLE_ROWS 或 pg_class.reltuples, 没有统计信息时为 None
+    rows: int | None = None
+    # 数据大小(字节)
+    data_length: int | None = None
+    # 索引大小(字节)
+    index_length: int | None = None
+
+    def __post_init__(self):
+        self.name = intern_str(self.name)
+
+
+@dataclass(frozen=True, slots=True)
+class DataProfile:
+    # 采样的行数
+    rows: int
+    # 采样中为 NULL 的行数, 不能计数的类型(Doris 的 bitmap 等)为 None
+    nulls: int | None
+    # 采样中不同值的数量, 不能判断相等的类型(json 等)为 None
+    distinct: int | None = None
+    # 最小值、最大值, 转换为字符串并截断, 不能比较大小的类型为 None
+    min: str | None = None
+    max: str | None = None
+
+    @property
+    def null_ratio(self):
+        return self.nulls / self.rows if self.rows and self.nulls is not None else None
+
+
+@dataclass(slots=True)
 class Column:
     # 表名
     table: str
@@ -50,87 +99,1219 @@ class Column:
 
     # 主键
     primary_key: bool = False
+    # 无符号, 只有 MySQL 的数值类型有
+    unsigned: bool = False
+    # enum/set 类型的可选值
+    enum_values: tuple = ()
+    # 采样统计的结果, 只有 doc --profile-data 时才有
+    data_profile: DataProfile | None = None
+
+    def __post_init__(self):
+        self.table = intern_str(self.table)
+        self.name = intern_str(self.name)
+        self.type = intern_str(self.type)
+        if type(self.enum_values) is list:
+            # 快照中保存为 JSON 数组
+            self.enum_values = tuple(self.enum_values)
+
+
+# ColumnStore 中除表名以外按列保存的属性
+COLUMN_STORE_FIELDS = [f.name for f in fields(Column) if f.name != 'table']
+
+
+class ColumnStore(Sequence):
+    """
+    按列存储一张表的所有字段: 每个属性一个列表, 不再为每个字段创建对象
+
+    下标访问和迭代时返回 ColumnView, 属性与 Column 相同, 模板和 ER 图不需要修改
+    """
+    __slots__ = ('table', 'values')
+
+    def __init__(self, table, columns):
+        self.table = intern_str(table)
+        self.values = tuple([getattr(c, f) for c in columns] for f in COLUMN_STORE_FIELDS)
+
+    def __len__(self):
+        return len(self.values[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ColumnView(self, index)
+
+
+class ColumnView:
+    """
+    ColumnStore 中的一个字段
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def table(self):
+        return self.store.table
+
+    def __eq__(self, other):
+        if not isinstance(other, (Column, ColumnView)):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in ('table', *COLUMN_STORE_FIELDS))
+
+    def __repr__(self):
+        return 'ColumnView(' + ', '.join(f"{f}={getattr(self, f)!r}" for f in ('table', *COLUMN_STORE_FIELDS)) + ')'
+
+
+def column_property(i):
+
+    def get(self):
+        return self.store.values[i][self.index]
+
+    def set(self, value):
+        self.store.values[i][self.index] = value
+
+    return property(get, set)
+
+
+for _i, _field in enumerate(COLUMN_STORE_FIELDS):
+    setattr(ColumnView, _field, column_property(_i))
+
+
+def compact_db(db):
+    """
+    把每张表的 Column 列表转换为 ColumnStore, 原来的 Column 对象随之释放
+    """
+    for table in db.tables:
+        if not isinstance(table.columns, ColumnStore):
+            table.columns = ColumnStore(table.name, table.columns)
+    return db
+
+
+@dataclass(slots=True)
+class ForeignKey:
+    # 约束名
+    name: str
+    # 表名
+    table: str
+    # 列
+    columns: list
+    # 引用的表
+    ref_table: str
+    # 引用的列
+    ref_columns: list
+
+
+# Table 的统计信息字段, 以及系统表查询结果中对应的列名
+TABLE_STATS_FIELDS = ('rows', 'data_length', 'index_length')
+TABLE_STATS_COLUMNS = ('table_rows', 'data_length', 'index_length')
+
+
+def table_stats(row, columns=TABLE_STATS_COLUMNS):
+    """
+    从系统表的查询结果中取出估算的行数和大小, PostgreSQL 未 ANALYZE 的表 reltuples 为 -1, 视为没有统计信息
+    """
+    stats = {}
+    for name, column in zip(TABLE_STATS_FIELDS, columns):
+        value = row.get(column)
+        stats[name] = int(value) if value is not None and value >= 0 else None
+    return stats
+
+
+def select_tables(db, min_rows=0, sort='name'):
+    """
+    按估算行数过滤表, 并按表名、行数或大小(数据+索引)排序, 没有统计信息的表不会被过滤
+    """
+    if min_rows:
+        db.tables = [table for table in db.tables if table.rows is None or table.rows >= min_rows]
+    if sort == 'rows':
+        db.tables.sort(key=lambda table: table.rows or 0, reverse=True)
+    elif sort == 'size':
+        db.tables.sort(key=lambda table: (table.data_length or 0) + (table.index_length or 0), reverse=True)
+    return db
 
 
 @click.group()
+@option('--progress', 'progress_mode', type=click.Choice(PROGRESS_MODES), default='auto', envvar='DEV_AUTO_PROGRESS',
+        help='progress output: bar on a terminal and log lines otherwise by default', show_default=True)
 @click.pass_context
-def cli(ctx):
-    pass
+def cli(ctx, progress_mode):
+    progress.MODE = progress_mode
 
 
 def exclude_table(table, include, exclude):
 
-    if include:
-        for i in include:
-            if re.match(i, table):
-                return False
-    if exclude:
-        for e in exclude:
-            if re.match(e, table):
-                return True
+    if include and table_matcher(tuple(include))(table):
+        return False
+    if exclude and table_matcher(tuple(exclude))(table):
+        return True
 
     return False
 
 
-def read_mysql_db(host, port, user, password, database, schema, include, exclude):
-    with pymysql.connect(host=host,
-                         port=int(port),
-                         user=user,
-                         password=password,
-                         db=database,
-                         charset='utf8mb4',
-                         cursorclass=pymysql.cursors.DictCursor) as connection:
+@lru_cache(maxsize=None)
+def table_matcher(patterns):
+    """
+    把多个正则合并为一个并只编译一次, 与逐个 re.match 的结果一致(从表名开头匹配)
+    """
+    try:
+        return re.compile('|'.join(f'(?:{p})' for p in patterns)).match
+    except re.error:
+        # 例如中间带有 (?i) 这类全局标记的正则不能合并, 逐个编译
+        compiled = [re.compile(p) for p in patterns]
+        return lambda table: any(c.match(table) for c in compiled)
+
+
+# 在 Python、PostgreSQL(ARE)、MySQL 8(ICU) 中含义相同的正则子集, 只有这类正则才下推到数据库;
+# {m,n} 量词不下推, Python 接受的 x{,3}、单独的 { 在 PostgreSQL 中是语法错误
+PUSHDOWN_SAFE = re.compile(r'(?:[\w.*+?|()\[\]^$-]|\\[dws.\\$^*+?()\[\]{}|_-])*')
+# Python 3.11 的占有量词 *+、++、?+、}+ 在 PostgreSQL 中是语法错误, 同样不下推(\++ 这类转义后的写法也一并排除)
+POSSESSIVE_QUANTIFIER = re.compile(r'[*+?}]\+')
+
+# 表名匹配条件, MySQL 的 REGEXP 受排序规则影响可能不区分大小写, 使用 'c' 强制区分
+MYSQL_REGEXP = "REGEXP_LIKE({column}, %s, 'c')"
+PG_REGEXP = "{column} ~ %s"
+
+
+def table_filter_patterns(include, exclude):
+    """
+    返回可以下推到数据库的 (exclude, include) 正则, 不能下推时返回 None
+
+    只设置 include 时不会排除任何表, 没有必要下推
+    """
+    if not exclude:
+        return None
+    patterns = [*(include or ()), *exclude]
+    if any('(?' in p or not PUSHDOWN_SAFE.fullmatch(p) or POSSESSIVE_QUANTIFIER.search(p) for p in patterns):
+        return None
+    anchored = lambda ps: '^(?:' + '|'.join(f'(?:{p})' for p in ps) + ')'
+    return anchored(exclude), anchored(include) if include else None
+
+
+def table_filter_sql(column, patterns, regexp):
+    """
+    生成追加到 WHERE 后的表名过滤条件和参数, 语义与 exclude_table 相同
+    """
+    if not patterns:
+        return '', ()
+    exclude, include = patterns
+    match = regexp.format(column=column)
+    if include:
+        return f" AND NOT ({match} AND NOT {match})", (exclude, include)
+    return f" AND NOT {match}", (exclude,)
+
+
+def with_table_filter(read, patterns, errors):
+    """
+    带上下推的表名过滤条件执行 read(patterns), 数据库不支持时(如 MySQL 5.7 没有 REGEXP_LIKE)
+    不带过滤条件重试, 由调用方在客户端过滤
+    """
+    if patterns:
+        try:
+            return read(patterns)
+        except errors as e:
+            click.echo(f"服务端过滤表名失败, 改为客户端过滤: {e}", err=True)
+    return read(None)
+
+
+def read_tables_parallel(connect, read_columns, tables, jobs, errors, retries=2):
+    """
+    使用 jobs 个连接并发读取每张表的列, 返回结果与 tables 顺序一致
+
+    每个工作线程持有自己的连接, 连接异常(errors)时丢弃该连接并重连重试
+    """
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def work(table):
+        for attempt in range(retries + 1):
+            try:
+                if getattr(local, 'connection', None) is None:
+                    local.connection = connect()
+                    with lock:
+                        connections.append(local.connection)
+                with local.connection.cursor() as cursor:
+                    return read_columns(cursor, table)
+            except errors as e:
+                # 第一次连接就失败时还没有 connection 属性
+                close_quietly(getattr(local, 'connection', None))
+                local.connection = None
+                if attempt == retries:
+                    raise
+                click.echo(f"读取表 {getattr(table, 'name', table)} 失败, 重试({attempt + 1}/{retries}): {e}", err=True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(work, tables))
+    finally:
+        for connection in connections:
+            close_quietly(connection)
+
+
+def counted(read_columns, progress):
+    # 每读完一张表推进一次进度
+    def read(cursor, table):
+        columns = read_columns(cursor, table)
+        progress.advance()
+        return columns
+
+    return read
+
+
+def close_quietly(connection):
+    if connection is None:
+        return
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    交互式 shell 中复用数据库连接: 连接关闭时放回池中, 之后相同参数的连接直接取出, 取出前检查连接是否可用
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def connect(self, key, connect, alive, reset):
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                connection = idle.pop() if idle else None
+            if connection is None:
+                connection = connect()
+                break
+            if alive(connection):
+                break
+            close_quietly(connection)
+        return PooledConnection(self, key, connection, reset)
+
+    def release(self, key, connection, reset):
+        try:
+            # 结束未提交的事务, 恢复 autocommit 等会话状态
+            reset(connection)
+        except Exception:
+            close_quietly(connection)
+            return
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+    def close(self):
+        with self.lock:
+            connections = [connection for idle in self.idle.values() for connection in idle]
+            self.idle.clear()
+        for connection in connections:
+            close_quietly(connection)
+
+
+class PooledConnection:
+    """
+    从连接池取出的连接, close 和 with 语句结束时放回连接池, 其余属性和方法直接使用原连接
+    """
+    __slots__ = ('pool', 'key', 'connection', 'reset')
+
+    def __init__(self, pool, key, connection, reset):
+        object.__setattr__(self, 'pool', pool)
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, 'reset', reset)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        if name in PooledConnection.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            # 例如 psycopg2 的 connection.autocommit = True
+            setattr(self.connection, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            self.pool.release(self.key, connection, self.reset)
+
+
+class Profile:
+    """
+    记录每个阶段和每张表的耗时、查询次数和返回行数
+
+    阶段可以嵌套, 以 read/connect 的形式命名; 工作线程中的阶段和查询归属到主线程当前的阶段
+    """
+
+    def __init__(self, render_output=None):
+        self.render_output = render_output
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.main = []
+        self.local.stack = self.main
+        self.local.table = None
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.tables = {}
+
+    def stack(self):
+        if getattr(self.local, 'stack', None) is None:
+            self.local.stack = list(self.main)
+        return self.local.stack
+
+    @staticmethod
+    def new_stats():
+        return {'seconds': 0.0, 'calls': 0, 'queries': 0, 'rows': 0}
+
+    @contextmanager
+    def phase(self, name):
+        stack = self.stack()
+        stack.append(name)
+        key = '/'.join(stack)
+        with self.lock:
+            stats = self.phases.setdefault(key, self.new_stats())
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                stats['seconds'] += seconds
+                stats['calls'] += 1
+
+    @contextmanager
+    def table(self, name):
+        with self.lock:
+            stats = self.tables.setdefault(name, self.new_stats())
+        self.local.table = stats
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.local.table = None
+            with self.lock:
+                stats['seconds'] += seconds
+                stats['calls'] += 1
+
+    def record_query(self, rows):
+        stack = self.stack() or self.main
+        rows = max(rows or 0, 0)
+        with self.lock:
+            stats = self.phases.setdefault('/'.join(stack), self.new_stats())
+            stats['queries'] += 1
+            stats['rows'] += rows
+            table = getattr(self.local, 'table', None)
+            if table is not None:
+                table['queries'] += 1
+                table['rows'] += rows
+
+    def to_dict(self):
+        return {
+            'seconds': round(time.perf_counter() - self.start, 6),
+            'phases': [{'name': name, **stats} for name, stats in self.phases.items()],
+            'tables': sorted(({'name': name, **stats} for name, stats in self.tables.items()),
+                             key=lambda t: t['seconds'], reverse=True),
+        }
+
+    def report(self, top=10):
+        data = self.to_dict()
+        click.echo(f"\n{'阶段':<30}{'耗时(秒)':>10}{'次数':>8}{'查询':>8}{'行数':>10}")
+        for p in data['phases']:
+            click.echo(f"{p['name']:<30}{p['seconds']:>10.3f}{p['calls']:>8}{p['queries']:>8}{p['rows']:>10}")
+        click.echo(f"总耗时 {data['seconds']:.3f} 秒")
+        if data['tables']:
+            click.echo(f"\n最慢的 {min(top, len(data['tables']))} 张表:")
+            for t in data['tables'][:top]:
+                click.echo(f"{t['name']:<30}{t['seconds']:>10.3f}{t['calls']:>8}{t['queries']:>8}{t['rows']:>10}")
+
+
+# 开启 --profile 时的统计对象
+PROFILE = None
+
+
+def profile_phase(name):
+    return PROFILE.phase(name) if PROFILE else nullcontext()
+
+
+def profile_table(read_columns):
+    """
+    逐表读取列的函数的装饰器, 开启 --profile 时记录每张表的耗时和查询
+    """
+    def wrapper(cursor, table, *args):
+        if not PROFILE:
+            return read_columns(cursor, table, *args)
+        with PROFILE.table(table):
+            return read_columns(cursor, table, *args)
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def profiled_cursor(base):
+    """
+    在 base 游标的基础上统计查询次数和行数, 只在开启 --profile 时使用
+    """
+    class ProfiledCursor(base):
+
+        def execute(self, query, *args, **kwargs):
+            try:
+                return super().execute(query, *args, **kwargs)
+            finally:
+                if PROFILE:
+                    PROFILE.record_query(self.rowcount)
+
+    return ProfiledCursor
+
+
+@contextmanager
+def profile_render():
+    """
+    开启 --profile-render 时分析渲染阶段的函数调用: .prof 结尾保存为 cProfile 格式, 否则保存为 speedscope 格式
+    """
+    path = PROFILE.render_output if PROFILE else None
+    if not path:
+        yield
+        return
+
+    if path.endswith('.prof'):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+        return
+
+    # speedscope 的 evented 格式, 记录每次 Python 函数调用的开始和结束
+    frames = {}
+    events = []
+    depth = [0]
+    start = time.perf_counter()
+
+    def tracer(frame, event, arg):
+        if event == 'call':
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            events.append({'type': 'O', 'frame': frames.setdefault(key, len(frames)),
+                           'at': time.perf_counter() - start})
+            depth[0] += 1
+        elif event == 'return' and depth[0] > 0:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            events.append({'type': 'C', 'frame': frames[key], 'at': time.perf_counter() - start})
+            depth[0] -= 1
+
+    sys.setprofile(tracer)
+    try:
+        yield
+    finally:
+        sys.setprofile(None)
+        end = time.perf_counter() - start
+        # 补齐分析结束时仍未返回的调用
+        open_frames = []
+        for e in events:
+            if e['type'] == 'O':
+                open_frames.append(e['frame'])
+            else:
+                open_frames.pop()
+        events.extend({'type': 'C', 'frame': f, 'at': end} for f in reversed(open_frames))
+        data = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': [{'name': name, 'file': file, 'line': line} for name, file, line in frames]},
+            'profiles': [{'type': 'evented', 'name': 'render', 'unit': 'seconds',
+                          'startValue': 0, 'endValue': end, 'events': events}],
+            'exporter': 'db-tool',
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+
+# 连接超时时间(秒), 避免无法访问的主机长时间阻塞
+CONNECT_TIMEOUT = 10
+
+# 交互式 shell 中设置为 ConnectionPool, 命令之间复用连接; 为 None 时每次新建连接
+CONNECTION_POOL = None
+
+
+def db_errors(dbtype):
+    """
+    dbtype 对应驱动的异常基类, 只导入该驱动
+    """
+    if dbtype == 'mysql' or dbtype == 'doris':
+        import pymysql
+        return pymysql.err.MySQLError
+    import psycopg2
+    return psycopg2.Error
+
+
+def connection_errors(dbtype):
+    """
+    连接断开等可以通过重连解决的异常
+    """
+    if dbtype == 'mysql' or dbtype == 'doris':
+        import pymysql
+        return pymysql.err.OperationalError, pymysql.err.InterfaceError
+    import psycopg2
+    return psycopg2.OperationalError, psycopg2.InterfaceError
+
+
+# 连接断开时 PyMySQL 的错误码: 无法连接、服务端已断开、查询过程中断开
+MYSQL_CONNECTION_LOST = (2003, 2006, 2013)
+
+
+def connection_lost(dbtype, e, connection):
+    """
+    查询失败是否因为连接断开; PyMySQL 把权限不足、超时等大部分服务端错误也报告为 OperationalError, 只能按错误码区分
+    """
+    if dbtype == 'mysql' or dbtype == 'doris':
+        import pymysql
+        return isinstance(e, pymysql.err.InterfaceError) or (
+                isinstance(e, pymysql.err.OperationalError) and bool(e.args) and e.args[0] in MYSQL_CONNECTION_LOST)
+    import psycopg2
+    return isinstance(e, psycopg2.InterfaceError) or bool(connection.closed)
+
+
+def connect_mysql(host, port, user, password, database):
+    if CONNECTION_POOL is not None:
+        key = ('mysql', host, str(port), user, password, database, bool(PROFILE))
+        return CONNECTION_POOL.connect(key, lambda: open_mysql(host, port, user, password, database),
+                                       ping_mysql, reset_mysql)
+    return open_mysql(host, port, user, password, database)
+
+
+def ping_mysql(connection):
+    try:
+        connection.ping(reconnect=False)
+        return True
+    except Exception:
+        return False
+
+
+def reset_mysql(connection):
+    connection.rollback()
+    if connection.get_autocommit():
+        connection.autocommit(False)
+
+
+def open_mysql(host, port, user, password, database):
+    import pymysql.cursors
+
+    with profile_phase('connect'):
+        return pymysql.connect(host=host,
+                               port=int(port),
+                               user=user,
+                               password=password,
+                               db=database,
+                               charset='utf8mb4',
+                               connect_timeout=CONNECT_TIMEOUT,
+                               cursorclass=profiled_cursor(pymysql.cursors.DictCursor) if PROFILE else pymysql.cursors.DictCursor)
+
+
+def connect_pg(host, port, user, password, database, schema=None):
+    if CONNECTION_POOL is not None:
+        key = ('postgresql', host, str(port), user, password, database, bool(PROFILE))
+        connection = CONNECTION_POOL.connect(key, lambda: open_pg(host, port, user, password, database),
+                                             ping_pg, reset_pg)
+    else:
+        connection = open_pg(host, port, user, password, database)
+    if schema:
         with connection.cursor() as cursor:
-            tables = get_all_tables(cursor)
-            table_list = []
+            update_schema(cursor, schema)
+    return connection
+
+
+# 流式读取时每次从服务端游标读取的行数
+STREAM_BATCH = 2000
+
+
+def iter_rows(cursor, on_batch=None):
+    """
+    分批读取查询结果, 配合服务端游标时内存中只保留一批行; on_batch 在每一批处理完之后调用
+    """
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            return
+        yield from rows
+        if on_batch:
+            on_batch()
+
+
+def stream_cursor_mysql(connection):
+    # 不缓存结果集的游标, 下一次查询之前必须读完当前结果
+    import pymysql.cursors
+
+    base = pymysql.cursors.SSDictCursor
+    return connection.cursor(profiled_cursor(base) if PROFILE else base)
+
+
+def stream_cursor_pg(connection):
+    # 命名游标即服务端游标, 只能执行一次查询, 游标类型沿用连接的 cursor_factory
+    return connection.cursor(name='db_tool_stream')
+
+
+def read_mysql_db(host, port, user, password, database, schema, include, exclude, bulk=True, jobs=1, stream=False):
+    import pymysql
+
+    with connect_mysql(host, port, user, password, database) as connection:
+        with connection.cursor() as cursor:
+            if bulk:
+                try:
+                    with stream_cursor_mysql(connection) if stream else nullcontext(cursor) as bulk_cursor:
+                        return with_table_filter(
+                            lambda patterns: read_mysql_db_bulk(bulk_cursor, database, include, exclude, patterns),
+                            table_filter_patterns(include, exclude), pymysql.err.MySQLError)
+                except pymysql.err.MySQLError as e:
+                    # 没有 information_schema 权限或者版本不兼容时, 回退到逐表读取
+                    click.echo(f"批量读取元数据失败, 回退到逐表读取: {e}", err=True)
+
+            tables = [table for table in get_all_tables(cursor) if not exclude_table(table, include, exclude)]
             # get table comment
 
             cursor.execute("show table status")
             table_status = cursor.fetchall()
             table_comment = {table['Name']: table['Comment'] for table in table_status}
-
-            for table in tables:
-                if exclude_table(table, include, exclude):
-                    continue
-                columns = get_all_columns(cursor, table)
-                table_list.append(Table(name=table, columns=columns, comment=table_comment.get(table, '')))
+            stats = {table['Name']: table_stats(table, ('Rows', 'Data_length', 'Index_length')) for table in table_status}
+
+            with Progress('read', '读取表结构', len(tables), '张表') as read_progress:
+                read_columns = counted(get_all_columns, read_progress)
+                if jobs > 1:
+                    all_columns = read_tables_parallel(
+                        lambda: connect_mysql(host, port, user, password, database),
+                        read_columns, tables, jobs,
+                        connection_errors('mysql'))
+                else:
+                    all_columns = [read_columns(cursor, table) for table in tables]
+
+            table_list = [Table(name=table, columns=columns, comment=table_comment.get(table, ''), **stats.get(table, {}))
+                          for table, columns in zip(tables, all_columns)]
             return Database(name=database, tables=table_list)
 
 
-def gen_file(template, output: str, db: Database | None):
-    doc = DocxTemplate(template)
-    context = {'db': db}
-    doc.render(context)
+def read_mysql_db_bulk(cursor, database, include, exclude, patterns=None):
+    # 通过 information_schema 一次性读取整个库的表、列、主键, 查询次数与表数量无关
+    tables = get_all_tables_bulk(cursor, database, patterns)
+    with Progress('read', '读取表结构', len(tables), '张表') as read_progress:
+        columns = get_all_columns_bulk(cursor, database, patterns, read_progress)
+
+    table_list = []
+    for table in tables:
+        if exclude_table(table['table_name'], include, exclude):
+            continue
+        table_list.append(Table(name=table['table_name'],
+                                columns=columns.get(table['table_name'], []),
+                                comment=table['table_comment'] or '',
+                                **table_stats(table)))
+    return Database(name=database, tables=table_list)
+
+
+def get_all_tables_bulk(cursor, database, patterns=None):
+    table_filter, params = table_filter_sql('TABLE_NAME', patterns, MYSQL_REGEXP)
+    cursor.execute(f"""
+    SELECT TABLE_NAME AS table_name, TABLE_COMMENT AS table_comment,
+           TABLE_ROWS AS table_rows, DATA_LENGTH AS data_length, INDEX_LENGTH AS index_length
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = %s{table_filter}
+    ORDER BY TABLE_NAME
+    """, (database, *params))
+    return cursor.fetchall()
+
+
+def get_all_columns_bulk(cursor, database, patterns=None, progress=NO_PROGRESS):
+    table_filter, params = table_filter_sql('TABLE_NAME', patterns, MYSQL_REGEXP)
+    cursor.execute(f"""
+    SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = %s AND INDEX_NAME = 'PRIMARY'{table_filter}
+    """, (database, *params))
+    primary_keys = {(row['table_name'], row['column_name']) for row in cursor.fetchall()}
+
+    cursor.execute(f"""
+    SELECT TABLE_NAME AS table_name,
+           COLUMN_NAME AS column_name,
+           COLUMN_TYPE AS column_type,
+           IS_NULLABLE AS is_nullable,
+           COLUMN_DEFAULT AS column_default,
+           COLUMN_COMMENT AS column_comment
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = %s{table_filter}
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """, (database, *params))
+
+    # 按表分组, 字段的构造方式与 get_all_columns 保持一致
+    columns = {}
+    for row in iter_rows(cursor, lambda: progress.update(len(columns))):
+        table = row['table_name']
+        column_type = parse_mysql_type(row['column_type'])
+        columns.setdefault(table, []).append(
+            Column(table=table, name=row['column_name'], type=column_type.name, length=column_type.length,
+                   decimal=column_type.decimal, unsigned=column_type.unsigned, enum_values=column_type.values,
+                   nullable=row['is_nullable'] == 'YES',
+                   default=row['column_default'] if row['column_default'] is not None else '',
+                   comment=row['column_comment'] if row['column_comment'] is not None else '',
+                   primary_key=(table, row['column_name']) in primary_keys))
+    return columns
+
+
+# 模板编译结果的磁盘缓存目录, 为 None 时只缓存在内存中
+TEMPLATE_CACHE_DIR = None
+
+# (路径, mtime, 大小) -> 模板文件内容
+_template_files = {}
+# XML 的 sha256 -> docxtpl 预处理之后的 XML
+_patched_xml = {}
+# Jinja 源码的 sha256 -> 编译好的 Jinja 模板
+_compiled_templates = {}
+
+
+def template_source(template):
+    """
+    读取模板文件, 按 路径、mtime、大小 缓存在内存中
+    """
+    st = os.stat(template)
+    key = (os.path.abspath(template), st.st_mtime_ns, st.st_size)
+    data = _template_files.get(key)
+    if data is None:
+        with open(template, 'rb') as f:
+            data = f.read()
+        _template_files[key] = data
+    return data
+
+
+@lru_cache(maxsize=None)
+def cached_template_classes():
+    """
+    DocxTemplate 每次渲染都会预处理正文 XML 并重新编译 Jinja 模板, 这里按内容的哈希缓存这两步的结果,
+    模板不变时多次渲染只做一次; 设置 TEMPLATE_CACHE_DIR 时结果同时保存到磁盘, 之后的进程直接加载
+    """
+    from docxtpl import DocxTemplate
+    from jinja2 import Environment, FileSystemBytecodeCache
+
+    class CachedEnvironment(Environment):
+
+        def from_string(self, source, globals=None, template_class=None):
+            if globals or template_class:
+                return super().from_string(source, globals, template_class)
+            key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+            compiled = _compiled_templates.get(key)
+            if compiled is None:
+                if self.bytecode_cache:
+                    # 与 jinja2 的 loader 相同的方式使用字节码缓存
+                    bucket = self.bytecode_cache.get_bucket(self, key, None, source)
+                    if bucket.code is None:
+                        bucket.code = self.compile(source)
+                        self.bytecode_cache.set_bucket(bucket)
+                    code = bucket.code
+                else:
+                    code = self.compile(source)
+                compiled = self.template_class.from_code(self, code, self.make_globals(None), None)
+                _compiled_templates[key] = compiled
+            return compiled
+
+    class CachedDocxTemplate(DocxTemplate):
+
+        def patch_xml(self, src_xml):
+            key = hashlib.sha256(src_xml.encode('utf-8')).hexdigest()
+            patched = _patched_xml.get(key)
+            if patched is None:
+                path = os.path.join(TEMPLATE_CACHE_DIR, key + '.xml') if TEMPLATE_CACHE_DIR else None
+                if path and os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8', newline='') as f:
+                        patched = f.read()
+                else:
+                    patched = super().patch_xml(src_xml)
+                    if path:
+                        with atomic_output(path) as tmp:
+                            with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                                f.write(patched)
+                _patched_xml[key] = patched
+            return patched
+
+    def environment(cache_dir):
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            return CachedEnvironment(bytecode_cache=FileSystemBytecodeCache(cache_dir))
+        return CachedEnvironment()
+
+    return CachedDocxTemplate, lru_cache(maxsize=None)(environment)
+
+
+def render_template(template, db):
+    """
+    使用缓存的模板渲染, 返回渲染后的 DocxTemplate
+    """
+    template_class, environment = cached_template_classes()
+    doc = template_class(io.BytesIO(template_source(template)))
+    doc.render({'db': db}, environment(TEMPLATE_CACHE_DIR))
+    return doc
+
+
+class TrackedTables(Sequence):
+    """
+    渲染时的表列表, 模板每遍历完一张表推进一次进度
+    """
+    __slots__ = ('tables', 'progress')
+
+    def __init__(self, tables, progress):
+        self.tables = tables
+        self.progress = progress
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __getitem__(self, index):
+        return self.tables[index]
+
+    def __iter__(self):
+        for table in self.tables:
+            yield table
+            self.progress.advance()
+
+
+def tracked(db, progress):
+    return Database(name=db.name, tables=TrackedTables(db.tables, progress), foreign_keys=db.foreign_keys)
+
+
+def gen_file(template, output: str, db: Database | None, chunk_size=0, jobs=1):
+    with profile_phase('render'), profile_render(), \
+            Progress('render', '渲染文档', len(db.tables), '张表') as render_progress:
+        if chunk_size and len(db.tables) > chunk_size:
+            doc = render_chunks(template, db, chunk_size, jobs, render_progress)
+        else:
+            doc = render_template(template, tracked(db, render_progress))
     try:
-        doc.save(output)
+        with profile_phase('save'), atomic_output(output, suffix='.docx') as tmp:
+            doc.save(tmp)
     except PermissionError as e:
         raise click.ClickException(f"无法保存文件: {output}, 请检查文件是否被占用或者被其他程序打开") from e
 
 
-def get_all_tables_pg(cursor, schema):
+@contextmanager
+def atomic_output(path, suffix='.tmp'):
+    """
+    先写入同目录下的临时文件, 成功后再替换目标文件, 读取方不会看到写了一半的文件
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix='.' + os.path.basename(path) + '.', suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp
+        # mkstemp 创建的文件权限为 0600, 替换前恢复为原文件或默认的权限
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def content_hash(db, template, fmt='docx'):
+    """
+    数据库结构和模板文件(非 Word 格式为格式名)的哈希, 两者都没有变化时生成的文档也不会变化
+
+    估算的行数和大小随着数据变化不断漂移, 只有输出这些字段的 JSON 格式才参与计算;
+    有采样统计结果时统计结果也参与计算, 没有时与之前的哈希保持一致
+    """
+    h = hashlib.sha256()
+    if fmt == 'docx':
+        h.update(template_source(template))
+    else:
+        h.update(fmt.encode('utf-8'))
+    h.update(json.dumps(db.name, ensure_ascii=False).encode('utf-8'))
+    for table in db.tables:
+        line = [table.name, table.comment,
+                [[getattr(c, field) for field in SNAPSHOT_COLUMN_FIELDS] for c in table.columns]]
+        if fmt == 'json':
+            line.append([getattr(table, field) for field in TABLE_STATS_FIELDS])
+        profiles = [c.data_profile and astuple(c.data_profile) for c in table.columns]
+        if any(profiles):
+            line.append(profiles)
+        h.update(json.dumps(line, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def write_doc(template, output, db, chunk_size=0, jobs=1, force=False, fmt='docx'):
+    """
+    生成文档, 数据库结构和模板都没有变化时跳过, 返回是否重新生成
+    """
+    with profile_phase('hash'):
+        fingerprint = content_hash(db, template, fmt)
+    if not force and is_up_to_date(output, fingerprint):
+        click.echo(f"数据库结构和模板均未变化, 跳过生成: {output}")
+        return False
+
+    if fmt == 'docx':
+        gen_file(template, output, db, chunk_size, jobs)
+    else:
+        gen_text_file(fmt, output, db)
+    save_hash(output, fingerprint)
+    click.echo(f"文件生成成功: {output}")
+    return True
+
+
+# 文档格式对应的文件扩展名
+DOC_FORMATS = {'docx': '.docx', 'markdown': '.md', 'html': '.html', 'json': '.json'}
+
+# 与 default.docx 中的表格列一致
+DOC_HEADERS = ['编号', '字段名称', '数据类型', '长度', '小数位', '允许空值', '主键', '默认值', '说明']
+
+
+def doc_row(index, c):
+    return [str(index), c.name, c.type, '' if not c.length else str(c.length), '' if not c.decimal else str(c.decimal),
+            '是' if c.nullable else '否', '是' if c.primary_key else '否', str(c.default), c.comment]
+
+
+# --profile-data 时追加的列, 统计值来自采样
+DOC_PROFILE_HEADERS = ['空值率', '不同值', '最小值', '最大值']
+
+
+def has_data_profile(table):
+    return any(c.data_profile is not None for c in table.columns)
+
+
+def data_profile_row(c):
+    p = c.data_profile
+    if p is None:
+        return [''] * len(DOC_PROFILE_HEADERS)
+    return ['' if p.null_ratio is None else f"{p.null_ratio:.1%}", '' if p.distinct is None else str(p.distinct),
+            p.min or '', p.max or '']
+
+
+def write_markdown(f, db):
+    escape = lambda v: v.replace('|', '\\|').replace('\r\n', '<br>').replace('\n', '<br>')
+    f.write(f"# 数据库名：{db.name}\n\n文档版本：1.0.0\n\n文档描述：数据库设计文档生成\n")
+    for table in db.tables:
+        profiled = has_data_profile(table)
+        headers = DOC_HEADERS + DOC_PROFILE_HEADERS if profiled else DOC_HEADERS
+        f.write(f"\n## 表 {table.name} ({escape(table.comment or '')})\n\n")
+        f.write('| ' + ' | '.join(headers) + ' |\n')
+        f.write('|' + ' --- |' * len(headers) + '\n')
+        for i, c in enumerate(table.columns, 1):
+            row = doc_row(i, c) + data_profile_row(c) if profiled else doc_row(i, c)
+            f.write('| ' + ' | '.join(escape(v) for v in row) + ' |\n')
+
+
+def write_html(f, db):
+    e = html.escape
+    f.write(f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{e(db.name)}</title>\n</head>\n<body>\n")
+    f.write(f"<p>数据库名：{e(db.name)}</p>\n<p>文档版本：1.0.0</p>\n<p>文档描述：数据库设计文档生成</p>\n")
+    header = ''.join(f"<th>{h}</th>" for h in DOC_HEADERS)
+    profile_header = ''.join(f"<th>{h}</th>" for h in DOC_PROFILE_HEADERS)
+    for table in db.tables:
+        profiled = has_data_profile(table)
+        f.write(f"<h2>表 {e(table.name)} ({e(table.comment or '')})</h2>\n<table border=\"1\">\n"
+                f"<tr>{header}{profile_header if profiled else ''}</tr>\n")
+        for i, c in enumerate(table.columns, 1):
+            row = doc_row(i, c) + data_profile_row(c) if profiled else doc_row(i, c)
+            f.write('<tr>' + ''.join(f"<td>{e(v)}</td>" for v in row) + '</tr>\n')
+        f.write("</table>\n")
+    f.write("</body>\n</html>\n")
+
+
+def json_column(c):
+    column = {field: getattr(c, field) for field in SNAPSHOT_COLUMN_FIELDS}
+    if c.data_profile is not None:
+        column['data_profile'] = {field.name: getattr(c.data_profile, field.name) for field in fields(DataProfile)}
+    return column
+
+
+def write_json(f, db):
+    # 逐表写出, 不在内存中构造整个文档
+    f.write('{"name": ' + json.dumps(db.name, ensure_ascii=False) + ', "tables": [')
+    for i, table in enumerate(db.tables):
+        line = {'name': table.name, 'comment': table.comment,
+                **{field: getattr(table, field) for field in TABLE_STATS_FIELDS},
+                'columns': [json_column(c) for c in table.columns]}
+        f.write((',\n' if i else '\n') + json.dumps(line, ensure_ascii=False, default=str))
+    f.write('\n]}\n')
+
+
+def gen_text_file(fmt, output, db):
+    write = {'markdown': write_markdown, 'html': write_html, 'json': write_json}[fmt]
+    with profile_phase('render'), atomic_output(output, suffix=DOC_FORMATS[fmt]) as tmp, \
+            Progress('render', '生成文档', len(db.tables), '张表') as render_progress:
+        with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+            write(f, tracked(db, render_progress))
+
+
+def hash_file(output):
+    return output + '.sha256'
+
+
+def is_up_to_date(output, fingerprint):
+    if not os.path.exists(output) or not os.path.exists(hash_file(output)):
+        return False
+    with open(hash_file(output), 'r') as f:
+        return f.read().strip() == fingerprint
+
+
+def save_hash(output, fingerprint):
+    with atomic_output(hash_file(output)) as tmp:
+        with open(tmp, 'w') as f:
+            f.write(fingerprint)
+
+
+def render_chunk(template, db):
+    # 在子进程中执行, 返回渲染后的 docx 文件内容
+    doc = render_template(template, db)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def worker_importable():
+    """
+    子进程是否能按模块名找到 render_chunk: fork 启动时继承父进程已加载的模块, 其他启动方式需要重新导入,
+    通过文件路径加载的模块(例如 dev-auto shell 中)在子进程中无法导入
+    """
+    import multiprocessing
+    from importlib.machinery import PathFinder
+
+    module = render_chunk.__module__
+    if module == '__main__':
+        return True
+    if multiprocessing.get_start_method() == 'fork':
+        return module in sys.modules
+    return PathFinder.find_spec(module) is not None
+
+
+def render_chunks(template, db, chunk_size, jobs=1, progress=NO_PROGRESS):
+    """
+    按 chunk_size 张表分批渲染模板, 再用 docxcompose 合并为一个文档
+
+    模板中表循环之前/之后的内容(标题、说明等)只保留一份: 先用空表渲染一次得到这部分内容,
+    再从每一批的渲染结果中去掉与之相同的开头和结尾
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docxcompose.composer import Composer
+    from lxml import etree
+
+    chunks = [Database(name=db.name, tables=db.tables[i:i + chunk_size])
+              for i in range(0, len(db.tables), chunk_size)]
+
+    frame = body_elements(Document(io.BytesIO(render_chunk(template, Database(name=db.name, tables=[])))))
+    frame = [etree.tostring(el) for el in frame]
+
+    composer = None
+    loop_head = None
+    if worker_importable():
+        pool = ProcessPoolExecutor(max_workers=jobs)
+    else:
+        click.echo("渲染子进程无法导入当前模块, 改为在当前进程中逐批渲染", err=True)
+        pool = nullcontext()
+    with pool as executor:
+        args = [(template, chunk) for chunk in chunks]
+        parts = bounded_map(executor, render_chunk, args, jobs * 2) if executor else (render_chunk(*a) for a in args)
+        for i, part in enumerate(parts):
+            doc = Document(io.BytesIO(part))
+            elements = body_elements(doc)
+            xml = lambda index: etree.tostring(elements[index])
+            head = 0
+            while head < len(frame) and head < len(elements) and frame[head] == xml(head):
+                head += 1
+            tail = 0
+            while tail < len(frame) - head and tail < len(elements) - head and frame[-1 - tail] == xml(-1 - tail):
+                tail += 1
+
+            # 循环标签所在的段落在每一批的开头都会留下一个相同的段落, 合并时只保留第一批的
+            if i == 0:
+                loop_head = xml(head) if head < len(elements) else None
+            elif head < len(elements) and xml(head) == loop_head:
+                head += 1
+
+            remove = []
+            if i > 0:
+                remove += elements[:head]
+            if i < len(chunks) - 1:
+                remove += elements[len(elements) - tail:]
+            for el in remove:
+                el.getparent().remove(el)
+
+            if composer is None:
+                composer = Composer(doc)
+                rels = relationship_keys(doc)
+            elif relationship_keys(doc) == rels:
+                # 与第一批引用的部件完全相同(同一个模板渲染, 没有新增图片/子文档等), 直接移动正文元素,
+                # 省去 docxcompose 逐个元素复制和合并样式、编号的开销
+                sect_pr = composer.doc.element.body.find(qn('w:sectPr'))
+                for el in body_elements(doc):
+                    # 跨文档移动元素比复制更慢, 这里和 docxcompose 一样使用 deepcopy
+                    if sect_pr is None:
+                        composer.doc.element.body.append(deepcopy(el))
+                    else:
+                        sect_pr.addprevious(deepcopy(el))
+            else:
+                composer.append(doc)
+            progress.advance(len(chunks[i].tables))
+
+    return composer
+
+
+def bounded_map(executor, fn, items, window):
+    # 与 executor.map 相同, 按顺序返回结果, 但同时最多只提交 window 个任务, 避免渲染结果堆积在内存中
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def relationship_keys(doc):
+    return sorted((rel.reltype, rel.target_ref) for rel in doc.part.rels.values())
+
+
+def body_elements(doc):
+    # 正文中的段落和表格, 不包括节属性
+    from docx.oxml.ns import qn
+
+    return [el for el in doc.element.body.iterchildren() if el.tag != qn('w:sectPr')]
+
+
+def get_all_tables_pg(cursor, schema, patterns=None):
+    table_filter, params = table_filter_sql('c.relname', patterns, PG_REGEXP)
     cursor.execute(f"""
     SELECT 
     c.relname AS table_name, 
-    obj_description(c.oid) AS table_comment
+    obj_description(c.oid) AS table_comment,
+    c.reltuples AS table_rows,
+    pg_table_size(c.oid) AS data_length,
+    pg_indexes_size(c.oid) AS index_length
 FROM 
     pg_class c
 JOIN 
     pg_namespace n ON c.relnamespace = n.oid
 WHERE 
-    n.nspname = '{schema}' AND 
-    c.relkind = 'r'
+    n.nspname = %s AND 
+    c.relkind = 'r'{table_filter}
 ORDER BY 
     c.relname;
-    """)
+    """, (schema, *params))
     tables = cursor.fetchall()
     return tables
 
 
-def get_all_columns_kb(cursor, table, schema):
-    # 执行SQL查询语句
-    cursor.execute(f"""
-    
-    
+# KingBase 的 information_schema.columns 定义, 额外输出表的 oid 便于按 oid 关联
+KB_COLUMNS_CTE = """
     with my_columns as (
     
     SELECT current_database()::information_schema.sql_identifier                                                                           AS table_catalog, nc.nspname::information_schema.sql_identifier                                                                                   AS table_schema, c.relname::information_schema.sql_identifier                                                                                    AS table_name, a.attname::information_schema.sql_identifier                                                                                    AS column_name, a.attnum::information_schema.cardinal_number                                                                                    AS ordinal_position, CASE
@@ -240,7 +1421,8 @@ END::information_schema
                 pg_column_is_updatable(c.oid::regclass, a.attnum, false) THEN 'YES'::text
            ELSE 'NO'::text
 END::information_schema
-.yes_or_no                                                                                           AS is_updatable
+.yes_or_no                                                                                           AS is_updatable,
+       c.oid                                                                                                AS table_oid
 FROM pg_attribute a
          LEFT JOIN pg_attrdef ad ON a.attrelid = ad.adrelid AND a.attnum = ad.adnum
          JOIN (pg_class c
@@ -264,6 +1446,14 @@ WHERE NOT pg_is_other_temp_schema(nc.oid)
        has_column_privilege(c.oid, a.attnum, 'SELECT, INSERT, UPDATE, REFERENCES'::text))
     
     )
+"""
+
+
+@profile_table
+def get_all_columns_kb(cursor, table, schema):
+    # 执行SQL查询语句
+    cursor.execute(f"""
+    {KB_COLUMNS_CTE}
     SELECT 
             c.table_name,
             c.column_name,
@@ -321,7 +1511,60 @@ WHERE NOT pg_is_other_temp_schema(nc.oid)
     return column_objects
 
 
-
+def get_all_columns_kb_bulk(cursor, schema, patterns=None, progress=NO_PROGRESS):
+    # my_columns 整个 schema 只计算一次, 主键和注释按表 oid 关联, 避免逐行的 regclass 子查询
+    table_filter, params = table_filter_sql('c.table_name::text', patterns, PG_REGEXP)
+    cursor.execute(f"""
+    {KB_COLUMNS_CTE}
+    SELECT 
+            c.table_name,
+            c.column_name,
+            c.data_type,
+            CASE 
+                WHEN c.data_type = 'character varying' OR c.data_type = 'varchar' THEN c.character_maximum_length
+                WHEN c.data_type = 'numeric' THEN c.numeric_precision
+                ELSE NULL
+            END AS length,
+            CASE 
+                WHEN c.data_type = 'numeric' THEN c.numeric_scale
+                ELSE NULL
+            END AS decimal,
+            c.is_nullable = 'YES' AS nullable,
+            c.column_default,
+            d.description AS comment,
+            COALESCE(c.ordinal_position::smallint = ANY(i.indkey), false) AS primary_key
+        FROM 
+            my_columns c
+        LEFT JOIN 
+            pg_description d ON d.objoid = c.table_oid AND d.classoid = 'pg_class'::regclass AND d.objsubid = c.ordinal_position
+        LEFT JOIN 
+            pg_index i ON i.indrelid = c.table_oid AND i.indisprimary
+        WHERE 
+            c.table_schema = %s{table_filter}
+        ORDER BY 
+            c.table_name, 
+            c.ordinal_position;
+    """, (schema, *params))
+
+    # 按表分组
+    columns = {}
+    for row in iter_rows(cursor, lambda: progress.update(len(columns))):
+        columns.setdefault(row['table_name'], []).append(
+            Column(
+                table=row['table_name'],
+                name=row['column_name'],
+                type=row['data_type'],
+                length=row['length'],
+                decimal=row['decimal'],
+                nullable=row['nullable'],
+                default=row['column_default'] or '',
+                comment=row['comment'] or '',
+                primary_key=row['primary_key']
+            ))
+    return columns
+
+
+@profile_table
 def get_all_columns_pg(cursor, table, schema):
     # 执行SQL查询语句
     cursor.execute(f"""
@@ -349,7 +1592,7 @@ def get_all_columns_pg(cursor, table, schema):
             ) AS primary_key
         FROM 
             information_schema.columns c
-        JOIN 
+        LEFT JOIN 
             pg_description d ON d.objoid = c.table_name::regclass AND d.objsubid = c.ordinal_position
         WHERE 
             c.table_schema = '{schema}'
@@ -372,7 +1615,7 @@ def get_all_columns_pg(cursor, table, schema):
             decimal=row['decimal'],
             nullable=row['nullable'],
             default=row['column_default'] or '',
-            comment=row['comment'],
+            comment=row['comment'] or '',
             primary_key=row['primary_key']
         )
         for row in columns
@@ -381,59 +1624,223 @@ def get_all_columns_pg(cursor, table, schema):
     return column_objects
 
 
-def read_postgresql_db(host, port, user, password, database, schema, include, exclude):
+def get_all_columns_pg_bulk(cursor, schema, patterns=None, progress=NO_PROGRESS):
+    # 直接基于 pg_attribute/pg_index 按 oid 关联, 一次查询返回整个 schema 的所有列,
+    # 类型/长度/精度的计算方式与 information_schema.columns 保持一致
+    table_filter, params = table_filter_sql('c.relname', patterns, PG_REGEXP)
+    cursor.execute(f"""
+        SELECT
+            c.relname AS table_name,
+            a.attname AS column_name,
+            CASE
+                WHEN t.typtype = 'd' THEN
+                    CASE
+                        WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                        WHEN nbt.nspname = 'pg_catalog' THEN format_type(t.typbasetype, NULL)
+                        ELSE 'USER-DEFINED'
+                    END
+                ELSE
+                    CASE
+                        WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+                        WHEN nt.nspname = 'pg_catalog' THEN format_type(a.atttypid, NULL)
+                        ELSE 'USER-DEFINED'
+                    END
+            END AS data_type,
+            information_schema._pg_char_max_length(information_schema._pg_truetypid(a.*, t.*),
+                                                   information_schema._pg_truetypmod(a.*, t.*)) AS character_maximum_length,
+            information_schema._pg_numeric_precision(information_schema._pg_truetypid(a.*, t.*),
+                                                     information_schema._pg_truetypmod(a.*, t.*)) AS numeric_precision,
+            information_schema._pg_numeric_scale(information_schema._pg_truetypid(a.*, t.*),
+                                                 information_schema._pg_truetypmod(a.*, t.*)) AS numeric_scale,
+            NOT (a.attnotnull OR (t.typtype = 'd' AND t.typnotnull)) AS nullable,
+            CASE WHEN a.attgenerated = '' THEN pg_get_expr(ad.adbin, ad.adrelid) END AS column_default,
+            d.description AS comment,
+            COALESCE(a.attnum = ANY(i.indkey), false) AS primary_key
+        FROM
+            pg_attribute a
+        JOIN
+            pg_class c ON c.oid = a.attrelid
+        JOIN
+            pg_namespace n ON n.oid = c.relnamespace
+        JOIN
+            (pg_type t JOIN pg_namespace nt ON t.typnamespace = nt.oid) ON t.oid = a.atttypid
+        LEFT JOIN
+            (pg_type bt JOIN pg_namespace nbt ON bt.typnamespace = nbt.oid) ON t.typtype = 'd' AND t.typbasetype = bt.oid
+        LEFT JOIN
+            pg_attrdef ad ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+        LEFT JOIN
+            pg_description d ON d.objoid = c.oid AND d.classoid = 'pg_class'::regclass AND d.objsubid = a.attnum
+        LEFT JOIN
+            pg_index i ON i.indrelid = c.oid AND i.indisprimary
+        WHERE
+            n.nspname = %s
+            AND c.relkind = 'r'
+            AND a.attnum > 0
+            AND NOT a.attisdropped{table_filter}
+        ORDER BY
+            c.relname,
+            a.attnum;
+    """, (schema, *params))
+
+    # 按表分组
+    columns = {}
+    for row in iter_rows(cursor, lambda: progress.update(len(columns))):
+        data_type = row['data_type']
+        if data_type == 'character varying' or data_type == 'varchar':
+            length = row['character_maximum_length']
+        elif data_type == 'numeric':
+            length = row['numeric_precision']
+        else:
+            length = None
+        columns.setdefault(row['table_name'], []).append(
+            Column(
+                table=row['table_name'],
+                name=row['column_name'],
+                type=data_type,
+                length=length,
+                decimal=row['numeric_scale'] if data_type == 'numeric' else None,
+                nullable=row['nullable'],
+                default=row['column_default'] or '',
+                comment=row['comment'] or '',
+                primary_key=row['primary_key']
+            ))
+    return columns
+
+
+def read_postgresql_db(host, port, user, password, database, schema, include, exclude, bulk=True, jobs=1,
+                       stream=False):
+    import psycopg2
+
     schema = schema or 'public'
 
-    with psycopg2.connect(database=database, user=user, password=password, host=host, port=port,
-                          cursor_factory=RealDictCursor) as connection:
+    with connect_pg(host, port, user, password, database) as connection:
         with connection.cursor() as cursor:
 
             update_schema(cursor, schema)
 
-            tables = get_all_tables_pg(cursor, schema)
-
-            table_list = []
-            for table in tables:
-
-                if exclude_table(table['table_name'], include, exclude):
-                    continue
-
-                all_columns_pg = get_all_columns_pg(cursor, table['table_name'], schema)
-                table_list.append(
-                    Table(name=table['table_name'], columns=all_columns_pg, comment=table['table_comment']))
-
+            patterns = table_filter_patterns(include, exclude)
+            tables = get_all_tables_pg(cursor, schema, patterns)
+
+            if bulk:
+                try:
+                    with stream_cursor_pg(connection) if stream else nullcontext(cursor) as bulk_cursor, \
+                            Progress('read', '读取表结构', len(tables), '张表') as read_progress:
+                        columns = get_all_columns_pg_bulk(bulk_cursor, schema, patterns, read_progress)
+                    table_list = [Table(name=table['table_name'], columns=columns.get(table['table_name'], []),
+                                        comment=table['table_comment'], **table_stats(table))
+                                  for table in tables if not exclude_table(table['table_name'], include, exclude)]
+                    return Database(name=database, tables=table_list)
+                except psycopg2.Error as e:
+                    # 事务已中断, 回滚后重新设置 search_path 再逐表读取
+                    click.echo(f"批量读取元数据失败, 回退到逐表读取: {e}", err=True)
+                    connection.rollback()
+                    update_schema(cursor, schema)
+
+            tables = [table for table in tables if not exclude_table(table['table_name'], include, exclude)]
+            read_columns = lambda c, table: get_all_columns_pg(c, table, schema)
+            table_names = [table['table_name'] for table in tables]
+
+            with Progress('read', '读取表结构', len(table_names), '张表') as read_progress:
+                read_columns = counted(read_columns, read_progress)
+                if jobs > 1:
+                    all_columns = read_tables_parallel(
+                        lambda: connect_pg(host, port, user, password, database, schema),
+                        read_columns, table_names, jobs,
+                        connection_errors('postgresql'))
+                else:
+                    all_columns = [read_columns(cursor, table) for table in table_names]
+
+            table_list = [Table(name=table['table_name'], columns=columns, comment=table['table_comment'],
+                                **table_stats(table))
+                          for table, columns in zip(tables, all_columns)]
             return Database(name=database, tables=table_list)
 
 
-def read_kingbase_db(host, port, user, password, database, schema, include, exclude):
+def read_kingbase_db(host, port, user, password, database, schema, include, exclude, bulk=True, jobs=1,
+                     stream=False):
+    import psycopg2
+
     schema = schema or 'public'
 
-    with psycopg2.connect(database=database, user=user, password=password, host=host, port=port,
-                          cursor_factory=RealDictCursor) as connection:
+    with connect_pg(host, port, user, password, database) as connection:
         with connection.cursor() as cursor:
 
 
             update_schema(cursor, schema)
 
-            tables = get_all_tables_pg(cursor, schema)
+            patterns = table_filter_patterns(include, exclude)
+            tables = get_all_tables_pg(cursor, schema, patterns)
+
+            if bulk:
+                try:
+                    with stream_cursor_pg(connection) if stream else nullcontext(cursor) as bulk_cursor, \
+                            Progress('read', '读取表结构', len(tables), '张表') as read_progress:
+                        columns = get_all_columns_kb_bulk(bulk_cursor, schema, patterns, read_progress)
+                    table_list = [Table(name=table['table_name'], columns=columns.get(table['table_name'], []),
+                                        comment=table['table_comment'], **table_stats(table))
+                                  for table in tables if not exclude_table(table['table_name'], include, exclude)]
+                    return Database(name=database, tables=table_list)
+                except psycopg2.Error as e:
+                    # 事务已中断, 回滚后重新设置 search_path 再逐表读取
+                    click.echo(f"批量读取元数据失败, 回退到逐表读取: {e}", err=True)
+                    connection.rollback()
+                    update_schema(cursor, schema)
+
+            tables = [table for table in tables if not exclude_table(table['table_name'], include, exclude)]
+            read_columns = lambda c, table: get_all_columns_kb(c, table, schema)
+            table_names = [table['table_name'] for table in tables]
+
+            with Progress('read', '读取表结构', len(table_names), '张表') as read_progress:
+                read_columns = counted(read_columns, read_progress)
+                if jobs > 1:
+                    all_columns = read_tables_parallel(
+                        lambda: connect_pg(host, port, user, password, database, schema),
+                        read_columns, table_names, jobs,
+                        connection_errors('postgresql'))
+                else:
+                    all_columns = [read_columns(cursor, table) for table in table_names]
+
+            table_list = [Table(name=table['table_name'], columns=columns, comment=table['table_comment'],
+                                **table_stats(table))
+                          for table, columns in zip(tables, all_columns)]
+            return Database(name=database, tables=table_list)
 
-            table_list = []
-            for table in tables:
-                if exclude_table(table['table_name'], include, exclude):
-                    continue
-                all_columns = get_all_columns_kb(cursor, table['table_name'], schema)
-                table_list.append(
-                    Table(name=table['table_name'], columns=all_columns, comment=table['table_comment']))
 
-            return Database(name=database, tables=table_list)
+def open_pg(host, port, user, password, database):
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    with profile_phase('connect'):
+        return psycopg2.connect(database=database, user=user, password=password, host=host, port=port,
+                                connect_timeout=CONNECT_TIMEOUT,
+                                cursor_factory=profiled_cursor(RealDictCursor) if PROFILE else RealDictCursor)
+
+
+def ping_pg(connection):
+    # closed 只反映客户端的状态, 服务端断开的连接需要执行一次查询才能发现
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def reset_pg(connection):
+    # search_path 在事务中设置, 回滚后也一并恢复
+    connection.rollback()
+    connection.autocommit = False
 
 
 def update_schema(cursor, schema):
     cursor.execute("SELECT current_schema()")
-    click.echo("current_schema is : " + cursor.fetchone()['current_schema'])
+    click.echo("current_schema is : " + cursor.fetchone()['current_schema'], err=True)
     set_cmd = f"SET search_path TO \"{schema}\",public"
     cursor.execute(set_cmd)
-    click.echo(f"execute: {set_cmd}")
+    click.echo(f"execute: {set_cmd}", err=True)
 
 
 def normalize_dbtype(dbtype):
@@ -444,73 +1851,253 @@ def normalize_dbtype(dbtype):
 
 
 def gen_er_diagram_text(db):
-    t = "erDiagram\n"
+    f = io.StringIO()
+    write_er_diagram(f, db.tables, db.foreign_keys)
+    return f.getvalue()
 
-    for table in db.tables:
-        t += f"    {table.name} {{\n"
+
+def write_er_diagram(f, tables, foreign_keys):
+    """
+    逐行写出 Mermaid ER 图, 只输出两端都在 tables 中的外键
+    """
+    names = {table.name for table in tables}
+    fk_columns = {(fk.table, c) for fk in foreign_keys for c in fk.columns}
+
+    f.write("erDiagram\n")
+    for table in tables:
+        f.write(f"    {table.name} {{\n")
         for column in table.columns:
-            t += f"        {column.type.replace(' ', '_')} {column.name} {'PK' if column.primary_key else ''} \"{column.comment}\"\n"
-        t += "    }\n"
+            keys = ['PK'] if column.primary_key else []
+            if (table.name, column.name) in fk_columns:
+                keys.append('FK')
+            comment = column.comment.replace('"', "'").replace('\n', ' ')
+            f.write(f"        {column.type.replace(' ', '_')} {column.name} {', '.join(keys)} \"{comment}\"\n")
+        f.write("    }\n")
 
-    return t
+    for fk in foreign_keys:
+        if fk.table in names and fk.ref_table in names:
+            f.write(f"    {fk.ref_table} ||--o{{ {fk.table} : \"{', '.join(fk.columns)}\"\n")
 
 
-def gen_er_diagram(erdiagram, db):
+def split_er_diagram(db, split, max_tables):
+    """
+    把表分成若干组, 每组单独生成一张 ER 图
+
+    component: 按外键关系的连通分量分组, 同一分量内按广度优先顺序排列, 超过 max_tables 的分量再拆开
+    prefix: 按表名第一个 _ 之前的前缀分组
+    较小的组会合并, 每组不超过 max_tables 张表
+    """
+    if split == 'none':
+        return [db.tables]
+
+    if split == 'prefix':
+        groups = {}
+        for table in db.tables:
+            groups.setdefault(table.name.split('_', 1)[0], []).append(table)
+        groups = [groups[prefix] for prefix in sorted(groups)]
+    else:
+        tables = {table.name: table for table in db.tables}
+        neighbours = {name: [] for name in tables}
+        for fk in db.foreign_keys:
+            if fk.table in tables and fk.ref_table in tables:
+                neighbours[fk.table].append(fk.ref_table)
+                neighbours[fk.ref_table].append(fk.table)
+        groups = []
+        visited = set()
+        for name in tables:
+            if name in visited:
+                continue
+            visited.add(name)
+            component = []
+            queue = deque([name])
+            while queue:
+                current = queue.popleft()
+                component.append(tables[current])
+                for n in neighbours[current]:
+                    if n not in visited:
+                        visited.add(n)
+                        queue.append(n)
+            groups.append(component)
+        # 关系多的分量排在前面
+        groups.sort(key=len, reverse=True)
+
+    parts = []
+    part = []
+    for group in groups:
+        for i in range(0, len(group), max_tables):
+            chunk = group[i:i + max_tables]
+            if len(part) + len(chunk) > max_tables:
+                parts.append(part)
+                part = []
+            part.extend(chunk)
+    if part:
+        parts.append(part)
+    return parts
+
+
+def gen_er_diagram(erdiagram, db, split='none', max_tables=100):
     
     if erdiagram == 'None'  or erdiagram == 'none':
         return
 
-    diagram_text = gen_er_diagram_text(db)
-
+    parts = split_er_diagram(db, split, max_tables)
 
     if erdiagram == 'console':
-        click.echo(diagram_text)
+        out = sys.stdout
+        for i, tables in enumerate(parts):
+            if len(parts) > 1:
+                out.write(f"%% {i + 1}/{len(parts)}\n")
+            write_er_diagram(out, tables, db.foreign_keys)
+            out.write("\n")
+        out.flush()
     else:
-        with open(erdiagram, 'w') as f:
-            f.write(diagram_text)
+        root, ext = os.path.splitext(erdiagram)
+        for i, tables in enumerate(parts):
+            path = f"{root}-{i + 1}{ext}" if len(parts) > 1 else erdiagram
+            with open(path, 'w', encoding='utf-8') as f:
+                write_er_diagram(f, tables, db.foreign_keys)
+        if len(parts) > 1:
+            click.echo(f"共 {len(parts)} 张 ER 图: {root}-1{ext} ... {root}-{len(parts)}{ext}", err=True)
+
+    click.echo(f"ER Diagram 生成成功, 登录 https://mermaid.live/edit 生成图形化ER图", err=True)
+
+
+def get_foreign_keys(cursor, database):
+    # 复合外键每列一行, 按约束名合并
+    cursor.execute("""
+    SELECT TABLE_NAME AS table_name,
+           CONSTRAINT_NAME AS name,
+           COLUMN_NAME AS column_name,
+           REFERENCED_TABLE_NAME AS ref_table,
+           REFERENCED_COLUMN_NAME AS ref_column
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = %s AND REFERENCED_TABLE_SCHEMA = %s AND REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+    """, (database, database))
+
+    foreign_keys = {}
+    for row in cursor.fetchall():
+        fk = foreign_keys.setdefault((row['table_name'], row['name']),
+                                     ForeignKey(name=row['name'], table=row['table_name'], columns=[],
+                                                ref_table=row['ref_table'], ref_columns=[]))
+        fk.columns.append(row['column_name'])
+        fk.ref_columns.append(row['ref_column'])
+    return list(foreign_keys.values())
+
+
+def get_foreign_keys_pg(cursor, schema):
+    cursor.execute("""
+    SELECT
+        con.conname AS name,
+        c.relname AS table_name,
+        rc.relname AS ref_table,
+        ARRAY(SELECT a.attname::text
+              FROM unnest(con.conkey) WITH ORDINALITY k(attnum, n)
+              JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+              ORDER BY k.n) AS columns,
+        ARRAY(SELECT a.attname::text
+              FROM unnest(con.confkey) WITH ORDINALITY k(attnum, n)
+              JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+              ORDER BY k.n) AS ref_columns
+    FROM
+        pg_constraint con
+    JOIN
+        pg_class c ON c.oid = con.conrelid
+    JOIN
+        pg_namespace n ON n.oid = c.relnamespace
+    JOIN
+        pg_class rc ON rc.oid = con.confrelid
+    JOIN
+        pg_namespace rn ON rn.oid = rc.relnamespace
+    WHERE
+        con.contype = 'f' AND n.nspname = %s AND rn.nspname = %s
+    ORDER BY
+        c.relname, con.conname;
+    """, (schema, schema))
+    return [ForeignKey(name=row['name'], table=row['table_name'], columns=row['columns'],
+                       ref_table=row['ref_table'], ref_columns=row['ref_columns'])
+            for row in cursor.fetchall()]
+
+
+def read_foreign_keys(dbtype, host, port, user, password, database, schema, db):
+    """
+    一次查询读取整个库(schema)的外键, 只保留两端都在 db 中的外键
+    """
+    errors = db_errors(dbtype)
+    try:
+        if dbtype == 'mysql' or dbtype == 'doris':
+            with connect_mysql(host, port, user, password, database) as connection:
+                with connection.cursor() as cursor:
+                    foreign_keys = get_foreign_keys(cursor, database)
+        else:
+            connection = connect_pg(host, port, user, password, database)
+            try:
+                with connection.cursor() as cursor:
+                    foreign_keys = get_foreign_keys_pg(cursor, schema or 'public')
+            finally:
+                close_quietly(connection)
+    except errors as e:
+        # 外键只影响 ER 图中的关系, 读取失败时不影响表结构
+        click.echo(f"读取外键失败, 忽略表之间的关系: {e}", err=True)
+        return []
 
-    click.echo(f"ER Diagram 生成成功, 登录 https://mermaid.live/edit 生成图形化ER图")
+    names = {table.name for table in db.tables}
+    return [fk for fk in foreign_keys if fk.table in names and fk.ref_table in names]
 
 
 
-@cli.command(name='doc')
-@click.pass_context
-@option("--jdbc", "-j", help="jdbc url for host port database")
-@option('--output', '-o', help='output file', default='db-doc.docx', show_default=True)
-@option("--dbtype", "-t", type=click.Choice(['mysql', 'postgresql', 'doris', 'kingbasees']), help="database type", default="mysql")
-@option("--host", "-h", help="database host")
-@option("--port", "-p", help="database port")
-@option("--user", "-u", help="database user")
-@option("--password", "-pwd", help="database password")
-@option("--schema", "-s", help="database schema")
-@option("--database", "-d", help="database name")
-@option("--open", help="open file after generate", is_flag=True, default=True)
-@option("--template", help="ms word template file", default="default.docx")
-@option("--include", help="include tables support regex", multiple=True)
-@option("--exclude", help="exclude tables support regex", multiple=True)
-@option("--erdiagram", help="output erDiagram", default='none')
-def db_doc(ctx, jdbc, output, dbtype, host, port, user, password, schema, database, open, template, include, exclude, erdiagram):
+def db_options(f):
     """
-    生成数据库文档
+    读取数据库结构的命令共用的连接选项
     """
+    options = [
+        option("--jdbc", "-j", help="jdbc url for host port database"),
+        option("--dbtype", "-t", type=click.Choice(['mysql', 'postgresql', 'doris', 'kingbasees']), help="database type", default="mysql"),
+        option("--host", "-h", help="database host"),
+        option("--port", "-p", help="database port"),
+        option("--user", "-u", help="database user"),
+        option("--password", "-pwd", help="database password"),
+        option("--schema", "-s", help="database schema"),
+        option("--database", "-d", help="database name"),
+        option("--include", help="include tables support regex", multiple=True),
+        option("--exclude", help="exclude tables support regex", multiple=True),
+        option("--bulk/--no-bulk", help="read table metadata from the catalog in bulk", default=True, show_default=True),
+        option("--jobs", help="connections used to read tables in parallel when not in bulk mode", type=click.IntRange(min=1), default=1, show_default=True),
+        option("--cache", help="only re-read tables whose catalog fingerprint changed since the last run", is_flag=True, default=False),
+        option("--cache-dir", help="directory of the incremental cache", default="~/.db-tool/cache", show_default=True),
+        option("--stream", help="read bulk catalog queries through server-side cursors in batches", is_flag=True, default=False),
+    ]
+    for o in reversed(options):
+        f = o(f)
+    return f
 
-    ensure_file(output)
-    output = os.path.abspath(output)
+
+def parse_jdbc(jdbc):
+    # jdbc:mysql://localhost:3306/test
+    m = re.match(r'jdbc:(\w+):\/\/([\w\.-]+):(\d+)\/(\w+)', jdbc)
+    if not m:
+        raise click.ClickException("jdbc url 格式不正确")
+    dbtype, host, port, database = m.groups()
+    return normalize_dbtype(dbtype), host, port, database
 
 
+# 交互式 shell 中设置为 dict, 记住每个 主机:端口 输入过的用户名和密码, 之后的命令不再询问
+SESSION_CREDENTIALS = None
+
+
+def resolve_connection(jdbc, dbtype, host, port, user, password, database):
+    """
+    解析 jdbc url, 缺少的连接信息通过交互方式补全
+    """
+    import survey
+
     if not host and not port and not jdbc and not database:
         use_jdbc = survey.routines.inquire("使用jdbc链接提供数据库信息? ", default=True)
         if use_jdbc:
             jdbc = survey.routines.input("请输入jdbc url: ")
 
     if jdbc:
-        # jdbc:mysql://localhost:3306/test
-        m = re.match(r'jdbc:(\w+):\/\/([\w\.-]+):(\d+)\/(\w+)', jdbc)
-        if m:
-            dbtype, host, port, database = m.groups()
-            dbtype = normalize_dbtype(dbtype)
-        else:
-            raise click.ClickException("jdbc url 格式不正确")
+        dbtype, host, port, database = parse_jdbc(jdbc)
 
     if not host:
         host = survey.routines.input("请输入数据库主机地址: ")
@@ -521,6 +2108,10 @@ def db_doc(ctx, jdbc, output, dbtype, host, port, user, password, schema, databa
     if not port:
         port = survey.routines.numeric("请输入数据库端口: ")
 
+    saved = SESSION_CREDENTIALS.get((host, str(port))) if SESSION_CREDENTIALS is not None else None
+    if saved and (not user or user == saved[0]):
+        user, password = saved[0], password or saved[1]
+
     if not user:
         user = survey.routines.input("请输入数据库用户名: ")
 
@@ -530,26 +2121,1059 @@ def db_doc(ctx, jdbc, output, dbtype, host, port, user, password, schema, databa
     if not database:
         database = survey.routines.input("请输入数据库名称: ")
 
-    click.echo(f'开始生成数据库文档: {dbtype} {host}:{port}/{database} -> {output}')
+    if SESSION_CREDENTIALS is not None:
+        SESSION_CREDENTIALS[(host, str(port))] = (user, password)
+    return dbtype, host, port, user, password, database
+
+
+def read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk=True, jobs=1, cache_dir=None,
+            stream=False):
+    if cache_dir:
+        return read_db_incremental(dbtype, host, port, user, password, database, schema, include, exclude, bulk,
+                                   jobs, cache_dir, stream)
 
     if dbtype == 'mysql' or dbtype == 'doris':
-        db = read_mysql_db(host, port, user, password, database, schema, include, exclude)
+        return read_mysql_db(host, port, user, password, database, schema, include, exclude, bulk, jobs, stream)
+    elif dbtype == 'postgresql':
+        return read_postgresql_db(host, port, user, password, database, schema, include, exclude, bulk, jobs, stream)
+    elif dbtype == 'kingbasees':
+        return read_kingbase_db(host, port, user, password, database, schema, include, exclude, bulk, jobs, stream)
+
+    raise click.ClickException(f"不支持的数据库类型: {dbtype}")
+
 
-    elif dbtype == 'postgresql' :
-        db = read_postgresql_db(host, port, user, password, database, schema, include, exclude)
+def get_table_fingerprints(cursor, database, patterns=None):
+    # 表的创建时间、注释以及所有列定义的校验和, 任意一项变化都认为表结构发生了变化;
+    # UPDATE_TIME 随每次写入变化, 不参与指纹
+    table_filter, params = table_filter_sql('t.TABLE_NAME', patterns, MYSQL_REGEXP)
+    cursor.execute(f"""
+    SELECT t.TABLE_NAME AS table_name,
+           t.TABLE_COMMENT AS table_comment,
+           t.TABLE_ROWS AS table_rows, t.DATA_LENGTH AS data_length, t.INDEX_LENGTH AS index_length,
+           CONCAT_WS(':', t.CREATE_TIME, t.TABLE_COMMENT, c.column_count, c.column_checksum) AS fingerprint
+    FROM information_schema.TABLES t
+    LEFT JOIN (
+        SELECT TABLE_NAME,
+               COUNT(*) AS column_count,
+               SUM(CRC32(CONCAT_WS('|', COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE,
+                                   COLUMN_DEFAULT, COLUMN_COMMENT, COLUMN_KEY))) AS column_checksum
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s
+        GROUP BY TABLE_NAME
+    ) c ON c.TABLE_NAME = t.TABLE_NAME
+    WHERE t.TABLE_SCHEMA = %s{table_filter}
+    ORDER BY t.TABLE_NAME
+    """, (database, database, *params))
+    return cursor.fetchall()
+
+
+def get_table_fingerprints_pg(cursor, schema, patterns=None):
+    # relfilenode 在表重写时变化, 各系统表行的 xmin 在 DDL/COMMENT 修改时变化, 行数用于识别删除
+    table_filter, params = table_filter_sql('c.relname', patterns, PG_REGEXP)
+    cursor.execute(f"""
+    SELECT
+        c.relname AS table_name,
+        obj_description(c.oid) AS table_comment,
+        c.reltuples AS table_rows, pg_table_size(c.oid) AS data_length, pg_indexes_size(c.oid) AS index_length,
+        concat_ws(':', c.relfilenode, c.xmin, c.relnatts,
+                  (SELECT count(*) || '/' || max(a.xmin::text::bigint) FROM pg_attribute a WHERE a.attrelid = c.oid),
+                  (SELECT count(*) || '/' || max(ad.xmin::text::bigint) FROM pg_attrdef ad WHERE ad.adrelid = c.oid),
+                  (SELECT count(*) || '/' || max(d.xmin::text::bigint) FROM pg_description d WHERE d.objoid = c.oid),
+                  (SELECT max(i.xmin::text::bigint) FROM pg_index i WHERE i.indrelid = c.oid AND i.indisprimary)
+        ) AS fingerprint
+    FROM
+        pg_class c
+    JOIN
+        pg_namespace n ON c.relnamespace = n.oid
+    WHERE
+        n.nspname = %s AND
+        c.relkind = 'r'{table_filter}
+    ORDER BY
+        c.relname;
+    """, (schema, *params))
+    return cursor.fetchall()
+
+
+def read_tables(dbtype, host, port, user, password, database, schema, tables, jobs=1):
+    """
+    逐表读取指定表的列, 返回结果与 tables 顺序一致
+    """
+    connect = connector(dbtype, host, port, user, password, database, schema)
+    if dbtype == 'mysql' or dbtype == 'doris':
+        read_columns = get_all_columns
     elif dbtype == 'kingbasees':
-        db = read_kingbase_db(host, port, user, password, database, schema, include, exclude)
+        read_columns = lambda c, table: get_all_columns_kb(c, table, schema)
     else:
-        click.echo(f"不支持的数据库类型: {dbtype}")
+        read_columns = lambda c, table: get_all_columns_pg(c, table, schema)
+
+    with Progress('read', '读取变化的表', len(tables), '张表') as read_progress:
+        read_columns = counted(read_columns, read_progress)
+        if jobs > 1:
+            return read_tables_parallel(connect, read_columns, tables, jobs, connection_errors(dbtype))
+
+        connection = connect()
+        try:
+            with connection.cursor() as cursor:
+                return [read_columns(cursor, table) for table in tables]
+        finally:
+            close_quietly(connection)
+
+
+def connector(dbtype, host, port, user, password, database, schema):
+    # 创建新连接的函数, 供多个线程各自建立连接
+    if dbtype == 'mysql' or dbtype == 'doris':
+        return lambda: connect_mysql(host, port, user, password, database)
+    return lambda: connect_pg(host, port, user, password, database, schema)
+
+
+# 采样统计时最小值/最大值保留的字符数
+DATA_PROFILE_VALUE_LENGTH = 100
+# 每个查询最多统计的列数: 每列 4 个聚合, PostgreSQL 的查询结果最多 1664 列
+DATA_PROFILE_COLUMNS_PER_QUERY = 200
+
+# Doris 的聚合类型不能计数、去重和比较, 复合类型不能去重和比较
+DORIS_AGGREGATE_TYPES = frozenset(['bitmap', 'hll', 'quantile_state', 'agg_state'])
+DORIS_COMPLEX_TYPES = frozenset(['array', 'map', 'struct', 'variant', 'json', 'jsonb'])
+# MySQL/Doris 中最小值/最大值没有意义或者不支持的类型
+MYSQL_NO_MIN_MAX = frozenset(['binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bit', 'json',
+                              'geometry', 'point', 'linestring', 'polygon', 'multipoint', 'multilinestring',
+                              'multipolygon', 'geometrycollection']) | DORIS_AGGREGATE_TYPES | DORIS_COMPLEX_TYPES
+# PostgreSQL/KingBase 中可以求最小值/最大值的类型(前缀), time 同时匹配 timestamp
+PG_MIN_MAX_TYPES = ('smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision', 'money', 'character',
+                    'text', 'date', 'time', 'interval', 'inet')
+# PostgreSQL/KingBase 中不能判断相等的类型, 自定义类型和数组也不统计不同值
+PG_NO_DISTINCT = frozenset(['json', 'xml', 'point', 'line', 'lseg', 'box', 'path', 'polygon', 'circle', 'USER-DEFINED',
+                            'ARRAY'])
+
+
+def data_profile_sql(dbtype, schema, table, columns, sample_rows, timeout_ms):
+    """
+    生成一张表一批列的采样统计查询: 在最多 sample_rows 行的样本上一次计算每列的非空数、不同值数量、最小值和最大值
+
+    PostgreSQL/KingBase 按估算行数通过 TABLESAMPLE SYSTEM 随机抽取数据块, 固定种子保证分多次查询时样本相同;
+    MySQL/Doris 没有可用的采样语法, 只读取前 sample_rows 行
+    """
+    mysql = dbtype == 'mysql' or dbtype == 'doris'
+    if mysql:
+        quote = lambda name: '`' + name.replace('`', '``') + '`'
+        text = lambda expr: expr
+        countable = lambda c: c.type not in DORIS_AGGREGATE_TYPES
+        min_max = lambda c: c.type not in MYSQL_NO_MIN_MAX
+        distinct = lambda c: countable(c) and (dbtype != 'doris' or c.type not in DORIS_COMPLEX_TYPES)
+    else:
+        quote = lambda name: '"' + name.replace('"', '""') + '"'
+        text = lambda expr: f"{expr}::text"
+        countable = lambda c: True
+        min_max = lambda c: c.type.startswith(PG_MIN_MAX_TYPES)
+        distinct = lambda c: c.type not in PG_NO_DISTINCT
+
+    items = ['COUNT(*) AS r']
+    for i, c in enumerate(columns):
+        name = quote(c.name)
+        items.append(f"COUNT({name}) AS n{i}" if countable(c) else f"NULL AS n{i}")
+        items.append(f"COUNT(DISTINCT {name}) AS d{i}" if distinct(c) else f"NULL AS d{i}")
+        if min_max(c):
+            items.append(f"LEFT({text(f'MIN({name})')}, {DATA_PROFILE_VALUE_LENGTH}) AS lo{i}")
+            items.append(f"LEFT({text(f'MAX({name})')}, {DATA_PROFILE_VALUE_LENGTH}) AS hi{i}")
+        else:
+            items.append(f"NULL AS lo{i}, NULL AS hi{i}")
+    # 样本中只需要参与聚合的列
+    names = ', '.join(quote(c.name) for c in columns if countable(c)) or '1'
+
+    if mysql:
+        # MAX_EXECUTION_TIME 只对 MySQL 5.7.8+ 生效, 其他版本和 Doris 会当作注释忽略
+        return (f"SELECT /*+ MAX_EXECUTION_TIME({timeout_ms}) */ {', '.join(items)} "
+                f"FROM (SELECT {names} FROM {quote(table.name)} LIMIT {sample_rows}) s")
+    percent = 100 if not table.rows or table.rows <= sample_rows else round(100 * sample_rows / table.rows, 4)
+    return (f"SELECT {', '.join(items)} FROM (SELECT {names} FROM {quote(schema)}.{quote(table.name)} "
+            f"TABLESAMPLE SYSTEM ({percent}) REPEATABLE (0) LIMIT {sample_rows}) s")
+
+
+def profile_table_data(cursor, dbtype, schema, table, sample_rows, deadline):
+    """
+    采样统计一张表所有列的数据, 返回 列名 -> DataProfile; 超出时间预算或查询失败时返回 None
+    """
+    profiles = {}
+    for i in range(0, len(table.columns), DATA_PROFILE_COLUMNS_PER_QUERY):
+        columns = table.columns[i:i + DATA_PROFILE_COLUMNS_PER_QUERY]
+        timeout_ms = int((deadline - time.monotonic()) * 1000)
+        if timeout_ms < 1:
+            # 超时时间为 0 表示不限制, 剩余不到 1 毫秒时不再开始查询
+            return None
+        if dbtype != 'mysql' and dbtype != 'doris':
+            # 只在当前事务内生效, 不影响连接之后的查询
+            cursor.execute(f"SET LOCAL statement_timeout = {timeout_ms}")
+        cursor.execute(data_profile_sql(dbtype, schema, table, columns, sample_rows, timeout_ms))
+        row = cursor.fetchone()
+        rows = int(row['r'])
+        for j, c in enumerate(columns):
+            distinct = row[f'd{j}']
+            profiles[c.name] = DataProfile(rows=rows, nulls=None if row[f'n{j}'] is None else rows - int(row[f'n{j}']),
+                                           distinct=None if distinct is None else int(distinct),
+                                           min=None if row[f'lo{j}'] is None else str(row[f'lo{j}']),
+                                           max=None if row[f'hi{j}'] is None else str(row[f'hi{j}']))
+    return profiles
+
+
+def profile_db_data(dbtype, host, port, user, password, database, schema, db, sample_rows, jobs, budget):
+    """
+    使用 jobs 个连接并发采样统计每张表的数据, 结果保存到每个字段的 data_profile
+
+    所有表共用 budget 秒的时间预算: 超时之后不再开始新的表, 正在执行的查询也会被数据库中止,
+    没有完成的表和查询失败的表不影响文档生成, 只是没有统计结果
+    """
+    if dbtype == 'mysql' or dbtype == 'doris':
+        import pymysql
+        query_errors = pymysql.err.MySQLError
+    else:
+        import psycopg2
+        query_errors = psycopg2.Error
+        schema = schema or 'public'
+    errors = connection_errors(dbtype)
+    deadline = time.monotonic() + budget
+
+    def profile(cursor, table):
+        try:
+            return profile_table_data(cursor, dbtype, schema, table, sample_rows, deadline)
+        except query_errors as e:
+            # 只有预算之内连接断开时才重连重试, 权限不足、不支持的聚合、超时等只是这张表没有结果
+            if time.monotonic() < deadline and connection_lost(dbtype, e, cursor.connection):
+                raise
+            click.echo(f"采样统计表 {table.name} 失败: {str(e).strip()}", err=True)
+            if dbtype != 'mysql' and dbtype != 'doris':
+                # 事务已中断, 回滚之后才能继续查询
+                try:
+                    cursor.connection.rollback()
+                except query_errors:
+                    pass
+            return None
+
+    tables = [table for table in db.tables if table.columns]
+    try:
+        with Progress('profile-data', '采样统计', len(tables), '张表') as profile_progress:
+            results = read_tables_parallel(connector(dbtype, host, port, user, password, database, schema),
+                                           counted(profile, profile_progress), tables, jobs, errors)
+    except errors as e:
+        # 重试之后仍然无法连接, 采样统计是可选的, 不影响文档生成
+        click.echo(f"采样统计失败, 无法连接数据库: {e}", err=True)
         return
 
-    gen_file(template, output, db)
+    skipped = 0
+    for table, profiles in zip(tables, results):
+        if profiles is None:
+            skipped += 1
+            continue
+        # 替换为新的字段对象, 不修改读取时缓存的表结构
+        table.columns = [replace(c, data_profile=profiles.get(c.name)) for c in table.columns]
+    if skipped:
+        click.echo(f"{skipped} 张表超出时间预算或查询失败, 没有采样统计结果", err=True)
 
-    click.echo(f"文件生成成功: {output}")
-    if open:
-        os.startfile(output)
-    
-    gen_er_diagram(erdiagram, db)
+
+def cache_file(cache_dir, dbtype, host, port, database, schema):
+    key = f"{dbtype}://{host}:{port}/{database}/{schema or ''}"
+    return os.path.join(os.path.expanduser(cache_dir), hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jsonl.gz')
+
+
+def read_db_incremental(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs, cache_dir,
+                        stream=False):
+    """
+    基于表结构指纹的增量读取: 只重新读取指纹发生变化的表, 其余表直接使用缓存
+    """
+    if dbtype not in ('mysql', 'doris', 'postgresql', 'kingbasees'):
+        raise click.ClickException(f"不支持的数据库类型: {dbtype}")
+    if dbtype != 'mysql' and dbtype != 'doris':
+        schema = schema or 'public'
+
+    path = cache_file(cache_dir, dbtype, host, port, database, schema)
+    patterns = table_filter_patterns(include, exclude)
+    errors = db_errors(dbtype)
+
+    try:
+        if dbtype == 'mysql' or dbtype == 'doris':
+            with connect_mysql(host, port, user, password, database) as connection:
+                with connection.cursor() as cursor:
+                    rows = with_table_filter(lambda p: get_table_fingerprints(cursor, database, p),
+                                             patterns, errors)
+        else:
+            connection = connect_pg(host, port, user, password, database)
+            try:
+                with connection.cursor() as cursor:
+                    rows = get_table_fingerprints_pg(cursor, schema, patterns)
+            finally:
+                close_quietly(connection)
+    except errors as e:
+        click.echo(f"读取表结构指纹失败, 不使用缓存: {e}", err=True)
+        return read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs,
+                       stream=stream)
+
+    rows = [row for row in rows if not exclude_table(row['table_name'], include, exclude)]
+    fingerprints = {row['table_name']: row['fingerprint'] for row in rows}
+
+    cached, cached_fingerprints = None, {}
+    if os.path.exists(path):
+        try:
+            cached, cached_fingerprints = read_snapshot(path)
+        except click.ClickException as e:
+            click.echo(f"缓存文件无效, 忽略缓存: {e.message}", err=True)
+    cached_tables = {table.name: table for table in cached.tables} if cached else {}
+    changed = [row for row in rows
+               if row['table_name'] not in cached_tables
+               or cached_fingerprints.get(row['table_name']) != row['fingerprint']]
+
+    if not cached or len(changed) > len(rows) / 2:
+        # 没有缓存或者大部分表都发生了变化, 直接全量读取
+        click.echo(f"全量读取表结构, 共 {len(rows)} 张表", err=True)
+        db = read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs,
+                     stream=stream)
+    else:
+        click.echo(f"表结构未变化 {len(rows) - len(changed)} 张, 重新读取 {len(changed)} 张", err=True)
+        all_columns = read_tables(dbtype, host, port, user, password, database, schema,
+                                  [row['table_name'] for row in changed], jobs)
+        tables = dict(cached_tables)
+        for row, columns in zip(changed, all_columns):
+            tables[row['table_name']] = Table(name=row['table_name'], columns=columns, comment=row['table_comment'])
+        # 缓存中的统计信息已经过期, 使用读取指纹时一起查到的估算值
+        db = Database(name=database, tables=[replace(tables[row['table_name']], **table_stats(row)) for row in rows])
+
+    # 全量读取期间新建的表没有指纹, 不写入指纹, 下次会重新读取
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    saved_fingerprints = {table.name: fingerprints.get(table.name) for table in db.tables}
+    with atomic_output(path, suffix='.jsonl.gz') as tmp:
+        save_snapshot(db, tmp, saved_fingerprints)
+    remember_snapshot(path, db, {name: fp for name, fp in saved_fingerprints.items() if fp is not None})
+    return db
+
+
+def get_catalog_fingerprint(cursor, database):
+    # 一条聚合查询, 与 get_table_fingerprints 使用相同的列定义校验和, 新建/删除/修改任意一张表都会改变结果
+    cursor.execute("""
+    SELECT CONCAT_WS(':', t.table_count, t.create_time, t.comment_checksum, c.column_count, c.column_checksum)
+           AS fingerprint
+    FROM (
+        SELECT COUNT(*) AS table_count, MAX(CREATE_TIME) AS create_time, SUM(CRC32(TABLE_COMMENT)) AS comment_checksum
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = %s
+    ) t, (
+        SELECT COUNT(*) AS column_count,
+               SUM(CRC32(CONCAT_WS('|', TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE,
+                                   COLUMN_DEFAULT, COLUMN_COMMENT, COLUMN_KEY))) AS column_checksum
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = %s
+    ) c
+    """, (database, database))
+    return cursor.fetchone()['fingerprint']
+
+
+def get_catalog_fingerprint_pg(cursor, schema):
+    # 与 get_table_fingerprints_pg 相同的系统表, 按 schema 聚合为一行
+    cursor.execute("""
+    WITH t AS (
+        SELECT c.oid, c.relfilenode, c.xmin
+        FROM pg_class c
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE n.nspname = %s AND c.relkind = 'r'
+    )
+    SELECT concat_ws(':',
+        (SELECT count(*) || '/' || sum(t.relfilenode::bigint) || '/' || max(t.xmin::text::bigint) FROM t),
+        (SELECT count(*) || '/' || max(a.xmin::text::bigint) FROM pg_attribute a JOIN t ON a.attrelid = t.oid),
+        (SELECT count(*) || '/' || max(ad.xmin::text::bigint) FROM pg_attrdef ad JOIN t ON ad.adrelid = t.oid),
+        (SELECT count(*) || '/' || max(d.xmin::text::bigint) FROM pg_description d JOIN t ON d.objoid = t.oid),
+        (SELECT max(i.xmin::text::bigint) FROM pg_index i JOIN t ON i.indrelid = t.oid WHERE i.indisprimary)
+    ) AS fingerprint
+    """, (schema,))
+    return cursor.fetchone()['fingerprint']
+
+
+class SchemaWatch:
+    """
+    监听一个数据库的表结构: 保持一个长连接, 每次轮询只执行一条目录指纹查询,
+    指纹变化时再比较每张表的结构指纹, 只重新读取发生变化的表
+    """
+
+    def __init__(self, dbtype, host, port, user, password, database, schema, include, exclude):
+        if dbtype not in ('mysql', 'doris', 'postgresql', 'kingbasees'):
+            raise click.ClickException(f"不支持的数据库类型: {dbtype}")
+        self.mysql = dbtype == 'mysql' or dbtype == 'doris'
+        self.dbtype, self.host, self.port, self.user, self.password = dbtype, host, port, user, password
+        self.database = database
+        self.schema = schema if self.mysql else schema or 'public'
+        self.include, self.exclude = include, exclude
+        self.patterns = table_filter_patterns(include, exclude)
+        self.errors = db_errors(dbtype)
+        self.connection = None
+        self.catalog = None
+        self.fingerprints = {}
+        self.tables = {}
+
+    def connect(self):
+        if self.connection is not None:
+            return self.connection
+        if self.mysql:
+            connection = connect_mysql(self.host, self.port, self.user, self.password, self.database)
+            # 长连接不能停留在一个事务中, 否则 information_schema 一直返回事务开始时的结果
+            connection.autocommit(True)
+            with connection.cursor() as cursor:
+                try:
+                    # MySQL 8.0 默认缓存 CREATE_TIME 等统计信息 24 小时
+                    cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                except self.errors:
+                    # MySQL 5.7 和 Doris 没有该变量
+                    pass
+        else:
+            connection = connect_pg(self.host, self.port, self.user, self.password, self.database)
+            connection.autocommit = True
+            # 逐表读取依赖 search_path, 需要在开启 autocommit 之后设置, 否则会随事务回滚
+            with connection.cursor() as cursor:
+                update_schema(cursor, self.schema)
+        self.connection = connection
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            close_quietly(self.connection)
+            self.connection = None
+
+    def catalog_fingerprint(self):
+        with self.connect().cursor() as cursor:
+            if self.mysql:
+                return get_catalog_fingerprint(cursor, self.database)
+            return get_catalog_fingerprint_pg(cursor, self.schema)
+
+    def table_fingerprints(self, cursor):
+        if self.mysql:
+            rows = with_table_filter(lambda p: get_table_fingerprints(cursor, self.database, p),
+                                     self.patterns, self.errors)
+        else:
+            rows = get_table_fingerprints_pg(cursor, self.schema, self.patterns)
+        return [row for row in rows if not exclude_table(row['table_name'], self.include, self.exclude)]
+
+    def read_columns(self, cursor, table):
+        if self.mysql:
+            return get_all_columns(cursor, table)
+        if self.dbtype == 'kingbasees':
+            return get_all_columns_kb(cursor, table, self.schema)
+        return get_all_columns_pg(cursor, table, self.schema)
+
+    def load(self, bulk=True, jobs=1, cache_dir=None, stream=False):
+        """
+        首次全量读取, 先记录指纹再读取表结构, 读取期间发生的变化会在下一次轮询时发现
+        """
+        self.catalog = self.catalog_fingerprint()
+        with self.connect().cursor() as cursor:
+            self.fingerprints = {row['table_name']: row['fingerprint'] for row in self.table_fingerprints(cursor)}
+        db = read_db(self.dbtype, self.host, self.port, self.user, self.password, self.database, self.schema,
+                     self.include, self.exclude, bulk, jobs, cache_dir, stream)
+        self.tables = {table.name: table for table in db.tables}
+        return db
+
+    def poll(self):
+        """
+        检查一次表结构, 有变化时返回新的 Database, 否则返回 None
+        """
+        catalog = self.catalog_fingerprint()
+        if catalog == self.catalog:
+            return None
+
+        with self.connect().cursor() as cursor:
+            rows = self.table_fingerprints(cursor)
+            changed = [row for row in rows
+                       if row['table_name'] not in self.tables
+                       or self.fingerprints.get(row['table_name']) != row['fingerprint']]
+            for row in changed:
+                self.tables[row['table_name']] = Table(name=row['table_name'], comment=row['table_comment'],
+                                                       columns=self.read_columns(cursor, row['table_name']))
+        dropped = self.tables.keys() - {row['table_name'] for row in rows}
+
+        # 全部读取成功后才更新指纹, 读取失败时下一次轮询会重试
+        self.catalog = catalog
+        self.fingerprints = {row['table_name']: row['fingerprint'] for row in rows}
+        self.tables = {row['table_name']: replace(self.tables[row['table_name']], **table_stats(row)) for row in rows}
+        if not changed and not dropped:
+            # 变化的表被 --include/--exclude 排除
+            return None
+        click.echo(f"表结构发生变化: 重新读取 {len(changed)} 张, 删除 {len(dropped)} 张", err=True)
+        return Database(name=self.database, tables=list(self.tables.values()))
+
+
+# 快照文件: 第一行为文件头, 之后每行一张表, 列按 SNAPSHOT_COLUMN_FIELDS 的顺序压缩为数组
+SNAPSHOT_FORMAT = 'db-tool-snapshot'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COLUMN_FIELDS = ['name', 'type', 'length', 'decimal', 'nullable', 'default', 'comment', 'primary_key',
+                          'unsigned', 'enum_values']
+
+
+def open_snapshot(path, mode):
+    # .gz 结尾的快照使用 gzip 压缩
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def save_snapshot(db, path, fingerprints=None):
+    with open_snapshot(path, 'w') as f:
+        header = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION, 'name': db.name,
+                  'columns': SNAPSHOT_COLUMN_FIELDS}
+        if db.foreign_keys:
+            header['foreign_keys'] = [[fk.name, fk.table, fk.columns, fk.ref_table, fk.ref_columns]
+                                      for fk in db.foreign_keys]
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for table in db.tables:
+            line = {'name': table.name, 'comment': table.comment,
+                    'columns': [[getattr(c, field) for field in SNAPSHOT_COLUMN_FIELDS] for c in table.columns]}
+            if table.rows is not None or table.data_length is not None:
+                line['stats'] = [getattr(table, field) for field in TABLE_STATS_FIELDS]
+            if fingerprints:
+                line['fingerprint'] = fingerprints.get(table.name)
+            f.write(json.dumps(line, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+
+
+# 交互式 shell 中设置为 dict, 按路径在内存中保留读取过的快照和增量缓存, 文件的 mtime 和大小不变时不再重新解析
+SNAPSHOT_CACHE = None
+
+
+def copy_db(db):
+    # 过滤表、按列保存等操作会修改 Database 和 Table, 缓存中保留副本, 字段对象共用
+    return Database(name=db.name, tables=[replace(table) for table in db.tables], foreign_keys=list(db.foreign_keys))
+
+
+def snapshot_version(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def remember_snapshot(path, db, fingerprints):
+    if SNAPSHOT_CACHE is not None:
+        SNAPSHOT_CACHE[os.path.abspath(path)] = (snapshot_version(path), copy_db(db), fingerprints)
+
+
+def read_snapshot(path):
+    """
+    读取快照文件, 返回 (Database, {表名: 指纹})
+    """
+    if SNAPSHOT_CACHE is None:
+        return parse_snapshot(path)
+    try:
+        version = snapshot_version(path)
+    except OSError as e:
+        raise click.ClickException(f"无法读取快照文件: {path}, {e}") from e
+    cached = SNAPSHOT_CACHE.get(os.path.abspath(path))
+    if cached is None or cached[0] != version:
+        db, fingerprints = parse_snapshot(path)
+        cached = SNAPSHOT_CACHE[os.path.abspath(path)] = (version, db, fingerprints)
+    return copy_db(cached[1]), dict(cached[2])
+
+
+def parse_snapshot(path):
+    try:
+        with open_snapshot(path, 'r') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+                raise click.ClickException(f"不支持的快照文件: {path}")
+            # 按文件头中的列属性读取, 兼容之前版本保存的快照
+            names = header.get('columns', SNAPSHOT_COLUMN_FIELDS)
+            tables = []
+            fingerprints = {}
+            for line in f:
+                t = json.loads(line)
+                columns = [Column(table=t['name'], **dict(zip(names, c))) for c in t['columns']]
+                tables.append(Table(name=t['name'], comment=t['comment'], columns=columns,
+                                    **dict(zip(TABLE_STATS_FIELDS, t.get('stats') or []))))
+                if t.get('fingerprint') is not None:
+                    fingerprints[t['name']] = t['fingerprint']
+            foreign_keys = [ForeignKey(*fk) for fk in header.get('foreign_keys', [])]
+            if names != SNAPSHOT_COLUMN_FIELDS:
+                # 缺少新增的列属性, 增量读取时不能再根据指纹复用这些表
+                fingerprints = {}
+            return Database(name=header['name'], tables=tables, foreign_keys=foreign_keys), fingerprints
+    except (OSError, ValueError) as e:
+        raise click.ClickException(f"无法读取快照文件: {path}, {e}") from e
+
+
+def load_snapshot(path, include=(), exclude=()):
+    """
+    读取快照文件, 与连接数据库读取时一样按 --include/--exclude 过滤表, 并去掉涉及被过滤表的外键
+    """
+    db = read_snapshot(path)[0]
+    if include or exclude:
+        db.tables = [table for table in db.tables if not exclude_table(table.name, include, exclude)]
+        names = {table.name for table in db.tables}
+        db.foreign_keys = [fk for fk in db.foreign_keys if fk.table in names and fk.ref_table in names]
+    return db
+
+
+@cli.command(name='doc')
+@click.pass_context
+@db_options
+@option('--output', '-o', help='output file', default='db-doc.docx', show_default=True)
+@option("--open/--no-open", help="open file after generate", default=True, show_default=True)
+@option("--template", help="ms word template file", default="default.docx")
+@option("--erdiagram", help="output erDiagram", default='none')
+@option("--from-snapshot", help="generate from a snapshot file instead of connecting to the database")
+@option("--chunk-size", help="render the document in batches of N tables, 0 to render in one pass", type=click.IntRange(min=0), default=0, show_default=True)
+@option("--render-jobs", help="processes used to render batches in parallel", type=click.IntRange(min=1), default=1, show_default=True)
+@option("--force", help="regenerate even if the schema and template have not changed", is_flag=True, default=False)
+@option("--format", "fmt", help="document format, the template is only used for docx", type=click.Choice(list(DOC_FORMATS)), default='docx', show_default=True)
+@option("--columnar", help="store columns of each table column-wise to reduce memory of large schemas", is_flag=True, default=False)
+@option("--template-cache", help="keep the compiled template under the cache dir and reuse it across runs", is_flag=True, default=False)
+@option("--min-rows", help="skip tables whose estimated row count is below N", type=click.IntRange(min=0), default=0)
+@option("--sort", help="order of the tables, rows and size are estimated from the catalog", type=click.Choice(['name', 'rows', 'size']), default='name', show_default=True)
+@option("--profile-data", help="sample each table to compute null ratio, distinct count, min and max of every column", is_flag=True, default=False)
+@option("--sample-rows", help="rows sampled from each table by --profile-data", type=click.IntRange(min=1), default=10000, show_default=True)
+@option("--sample-jobs", help="tables sampled at the same time by --profile-data", type=click.IntRange(min=1), default=4, show_default=True)
+@option("--sample-budget", help="seconds allowed for --profile-data, tables not finished in time have no results", type=click.FloatRange(min=0, min_open=True), default=60, show_default=True)
+@option("--profile", help="record time, queries and rows of each phase and table", is_flag=True, default=False, envvar='DB_TOOL_PROFILE')
+@option("--profile-top", help="slowest tables to report", type=click.IntRange(min=0), default=10, show_default=True)
+@option("--profile-output", help="write the profile data as JSON", envvar='DB_TOOL_PROFILE_OUTPUT')
+@option("--profile-render", help="profile the render phase, cProfile if ends with .prof, otherwise speedscope JSON")
+def db_doc(ctx, jdbc, dbtype, host, port, user, password, schema, database, include, exclude, bulk, jobs, cache,
+           cache_dir, stream, output, open, template, erdiagram, from_snapshot, chunk_size, render_jobs, force, fmt, columnar,
+           template_cache, min_rows, sort, profile_data, sample_rows, sample_jobs, sample_budget, profile, profile_top,
+           profile_output, profile_render):
+    """
+    生成数据库文档
+    """
+    global PROFILE, TEMPLATE_CACHE_DIR
+
+    # 交互式 shell 中会多次执行命令, 没有指定时恢复为只在内存中缓存
+    TEMPLATE_CACHE_DIR = os.path.join(os.path.expanduser(cache_dir), 'templates') if template_cache else None
+
+    if fmt != 'docx' and ctx.get_parameter_source('output') == click.core.ParameterSource.DEFAULT:
+        output = os.path.splitext(output)[0] + DOC_FORMATS[fmt]
+    ensure_file(output)
+    output = os.path.abspath(output)
+
+    if profile or profile_output or profile_render:
+        PROFILE = Profile(profile_render)
+    try:
+        with profile_phase('read'):
+            if from_snapshot:
+                click.echo(f'开始生成数据库文档: {from_snapshot} -> {output}')
+                db = select_tables(load_snapshot(from_snapshot, include, exclude), min_rows, sort)
+                if profile_data:
+                    click.echo("快照中没有表数据, 忽略 --profile-data")
+            else:
+                dbtype, host, port, user, password, database = resolve_connection(jdbc, dbtype, host, port, user, password, database)
+                click.echo(f'开始生成数据库文档: {dbtype} {host}:{port}/{database} -> {output}')
+                db = read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs,
+                             cache_dir if cache else None, stream)
+                select_tables(db, min_rows, sort)
+                if erdiagram.lower() != 'none':
+                    db.foreign_keys = read_foreign_keys(dbtype, host, port, user, password, database, schema, db)
+                if profile_data:
+                    with profile_phase('profile-data'):
+                        profile_db_data(dbtype, host, port, user, password, database, schema, db, sample_rows,
+                                        sample_jobs, sample_budget)
+            if columnar:
+                compact_db(db)
+
+        write_doc(template, output, db, chunk_size, render_jobs, force, fmt)
+
+        if open:
+            click.launch(output)
+
+        with profile_phase('er'):
+            gen_er_diagram(erdiagram, db)
+    finally:
+        if PROFILE:
+            PROFILE.report(profile_top)
+            if profile_output:
+                # open 参数覆盖了内置的 open
+                with io.open(profile_output, 'w', encoding='utf-8') as f:
+                    json.dump(PROFILE.to_dict(), f, ensure_ascii=False, indent=2)
+            PROFILE = None
+
+
+def load_manifest(path):
+    """
+    读取批量生成文档的清单, 支持 JSON 和 YAML(需要安装 PyYAML)
+
+    清单可以是数据库列表, 也可以是 {"defaults": {...}, "databases": [...]},
+    列表中的每一项可以是 jdbc url 字符串, 也可以是包含 jdbc/user/password/schema 等字段的对象
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.yaml') or path.endswith('.yml'):
+                try:
+                    import yaml
+                except ImportError as e:
+                    raise click.ClickException("读取 YAML 清单需要安装 PyYAML: pip install pyyaml") from e
+                manifest = yaml.safe_load(f)
+            else:
+                manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(f"无法读取清单文件: {path}, {e}") from e
+
+    if isinstance(manifest, list):
+        manifest = {'databases': manifest}
+    defaults = manifest.get('defaults') or {}
+    entries = []
+    for entry in manifest.get('databases') or []:
+        if isinstance(entry, str):
+            entry = {'jdbc': entry}
+        entry = {**defaults, **entry}
+        # 用户名密码支持 ${ENV} 形式引用环境变量, 避免在清单中保存明文密码
+        for key in ('user', 'password'):
+            if isinstance(entry.get(key), str):
+                entry[key] = os.path.expandvars(entry[key])
+        entries.append(entry)
+    return entries
+
+
+def batch_entry_name(entry):
+    return entry.get('name') or entry.get('jdbc') or entry.get('database')
+
+
+def doc_batch_entry(entry, output_dir, template, bulk, jobs, cache_dir, chunk_size, force, fmt='docx',
+                    columnar=False, stream=False):
+    """
+    生成清单中一个数据库的文档, 返回包含耗时和错误信息的结果, 不抛出异常
+    """
+    start = time.perf_counter()
+    result = {'name': batch_entry_name(entry), 'status': 'failed',
+              'tables': 0, 'seconds': 0, 'output': None, 'error': None}
+    try:
+        if entry.get('jdbc'):
+            dbtype, host, port, database = parse_jdbc(entry['jdbc'])
+        else:
+            dbtype, host, port, database = entry.get('dbtype', 'mysql'), entry['host'], entry['port'], entry['database']
+        name = entry.get('name') or f"{host}_{port}_{database}"
+        fmt = entry.get('format') or fmt
+        if fmt not in DOC_FORMATS:
+            raise click.ClickException(f"不支持的文档格式: {fmt}")
+        output = os.path.abspath(os.path.join(output_dir, entry.get('output') or f"{name}{DOC_FORMATS[fmt]}"))
+        result.update(name=name, output=output)
+
+        click.echo(f'开始生成数据库文档: {dbtype} {host}:{port}/{database} -> {output}')
+        db = read_db(dbtype, host, port, entry.get('user'), entry.get('password'), database, entry.get('schema'),
+                     entry.get('include') or [], entry.get('exclude') or [], bulk, jobs, cache_dir, stream)
+        if columnar:
+            compact_db(db)
+        generated = write_doc(entry.get('template') or template, output, db, chunk_size, 1, force, fmt)
+        result.update(status='generated' if generated else 'skipped', tables=len(db.tables))
+    except Exception as e:
+        error = e.message if isinstance(e, click.ClickException) else f"{type(e).__name__}: {e}"
+        result['error'] = ' '.join(error.split())
+        click.echo(f"生成数据库文档失败: {result['name']}, {result['error']}", err=True)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+@cli.command(name='doc-batch')
+@click.pass_context
+@argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@option("--output-dir", "-o", help="directory of the generated documents", default='.', show_default=True)
+@option("--template", help="ms word template file", default="default.docx")
+@option("--concurrency", "-c", help="databases documented at the same time", type=click.IntRange(min=1), default=4, show_default=True)
+@option("--connect-timeout", help="database connect timeout in seconds", type=click.IntRange(min=1), default=CONNECT_TIMEOUT, show_default=True)
+@option("--bulk/--no-bulk", help="read table metadata from the catalog in bulk", default=True, show_default=True)
+@option("--jobs", help="connections per database used to read tables in parallel when not in bulk mode", type=click.IntRange(min=1), default=1, show_default=True)
+@option("--cache", help="only re-read tables whose catalog fingerprint changed since the last run", is_flag=True, default=False)
+@option("--cache-dir", help="directory of the incremental cache", default="~/.db-tool/cache", show_default=True)
+@option("--stream", help="read bulk catalog queries through server-side cursors in batches", is_flag=True, default=False)
+@option("--chunk-size", help="render the document in batches of N tables, 0 to render in one pass", type=click.IntRange(min=0), default=0, show_default=True)
+@option("--force", help="regenerate even if the schema and template have not changed", is_flag=True, default=False)
+@option("--summary", help="write the timings and failures as json to this file")
+@option("--format", "fmt", help="document format, can be overridden by the format of each database", type=click.Choice(list(DOC_FORMATS)), default='docx', show_default=True)
+@option("--columnar", help="store columns of each table column-wise to reduce memory of large schemas", is_flag=True, default=False)
+@option("--template-cache", help="keep the compiled template under the cache dir and reuse it across runs", is_flag=True, default=False)
+def db_doc_batch(ctx, manifest, output_dir, template, concurrency, connect_timeout, bulk, jobs, cache, cache_dir,
+                 stream, chunk_size, force, summary, fmt, columnar, template_cache):
+    """
+    根据清单文件批量生成数据库文档
+    """
+    global CONNECT_TIMEOUT, TEMPLATE_CACHE_DIR
+    # dev-auto 交互环境中多个命令在同一进程内执行, 结束后恢复全局设置
+    saved = CONNECT_TIMEOUT, TEMPLATE_CACHE_DIR
+    CONNECT_TIMEOUT = connect_timeout
+    TEMPLATE_CACHE_DIR = os.path.join(os.path.expanduser(cache_dir), 'templates') if template_cache else None
+    try:
+        entries = load_manifest(manifest)
+        os.makedirs(output_dir, exist_ok=True)
+
+        def run(entry):
+            # 各个库的进度日志行带上库名
+            with progress.task(batch_entry_name(entry)):
+                result = doc_batch_entry(entry, output_dir, template, bulk, jobs, cache_dir if cache else None,
+                                         chunk_size, force, fmt, columnar, stream)
+            batch_progress.advance()
+            return result
+
+        start = time.perf_counter()
+        # 多个库同时生成, 进度条会和每个库的输出交错, 改为输出各个库和整体进度的日志行
+        with progress.concurrent(), Progress('batch', '批量生成文档', len(entries), '个库') as batch_progress, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run, entries))
+        elapsed = round(time.perf_counter() - start, 3)
+
+        click.echo(f"\n{'状态':<10}{'耗时(秒)':>10}{'表数量':>8}  数据库")
+        for r in results:
+            click.echo(f"{r['status']:<10}{r['seconds']:>10}{r['tables']:>8}  {r['name']}" + (f"  {r['error']}" if r['error'] else ''))
+        failed = [r for r in results if r['status'] == 'failed']
+        click.echo(f"共 {len(results)} 个数据库, 失败 {len(failed)} 个, 总耗时 {elapsed} 秒")
+
+        if summary:
+            with atomic_output(summary) as tmp:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({'seconds': elapsed, 'databases': results}, f, ensure_ascii=False, indent=2)
+
+        if failed:
+            ctx.exit(1)
+    finally:
+        CONNECT_TIMEOUT, TEMPLATE_CACHE_DIR = saved
+
+
+@cli.command(name='er')
+@db_options
+@option("--output", "-o", help="output erDiagram file, console for stdout", default='console', show_default=True)
+@option("--from-snapshot", help="generate from a snapshot file instead of connecting to the database")
+@option("--split", help="split into diagrams by foreign key connected component or table name prefix", type=click.Choice(['none', 'component', 'prefix']), default='none', show_default=True)
+@option("--max-tables", help="max tables per diagram when split", type=click.IntRange(min=1), default=100, show_default=True)
+@option("--columnar", help="store columns of each table column-wise to reduce memory of large schemas", is_flag=True, default=False)
+@option("--min-rows", help="skip tables whose estimated row count is below N", type=click.IntRange(min=0), default=0)
+@option("--sort", help="order of the tables, rows and size are estimated from the catalog", type=click.Choice(['name', 'rows', 'size']), default='name', show_default=True)
+def db_er(jdbc, dbtype, host, port, user, password, schema, database, include, exclude, bulk, jobs, cache, cache_dir,
+          stream, output, from_snapshot, split, max_tables, columnar, min_rows, sort):
+    """
+    生成 ER 图
+    """
+    if from_snapshot:
+        db = select_tables(load_snapshot(from_snapshot, include, exclude), min_rows, sort)
+    else:
+        dbtype, host, port, user, password, database = resolve_connection(jdbc, dbtype, host, port, user, password, database)
+        db = read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs,
+                     cache_dir if cache else None, stream)
+        select_tables(db, min_rows, sort)
+        db.foreign_keys = read_foreign_keys(dbtype, host, port, user, password, database, schema, db)
+    if columnar:
+        compact_db(db)
+
+    gen_er_diagram(output, db, split, max_tables)
+
+
+@cli.command(name='snapshot')
+@db_options
+@option('--output', '-o', help='snapshot file, gzip compressed if ends with .gz', default='db-snapshot.jsonl', show_default=True)
+def db_snapshot(jdbc, dbtype, host, port, user, password, schema, database, include, exclude, bulk, jobs, cache,
+                cache_dir, stream, output):
+    """
+    保存数据库结构快照, 之后可以通过 --from-snapshot 离线生成文档
+    """
+    output = os.path.abspath(output)
+    dbtype, host, port, user, password, database = resolve_connection(jdbc, dbtype, host, port, user, password, database)
+    click.echo(f'开始读取数据库结构: {dbtype} {host}:{port}/{database} -> {output}')
+    db = read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk, jobs,
+                 cache_dir if cache else None, stream)
+    db.foreign_keys = read_foreign_keys(dbtype, host, port, user, password, database, schema, db)
+
+    with atomic_output(output, suffix='.jsonl.gz' if output.endswith('.gz') else '.jsonl') as tmp:
+        save_snapshot(db, tmp)
+    click.echo(f"快照生成成功: {output}, 共 {len(db.tables)} 张表")
+
+
+# diff 比较的列属性, 列名用于匹配同一列
+DIFF_COLUMN_FIELDS = ['type', 'length', 'decimal', 'nullable', 'default', 'comment', 'primary_key', 'unsigned',
+                      'enum_values']
+
+
+column_values = attrgetter(*DIFF_COLUMN_FIELDS)
+column_key = attrgetter('name', *DIFF_COLUMN_FIELDS)
+
+
+def column_signature(c):
+    # 不同数据库和快照中长度等属性可能是数字也可能是字符串, 统一转为字符串比较
+    return tuple([v if type(v) is str else '' if v is None else str(v) for v in column_values(c)])
+
+
+def table_signature(table):
+    # 表注释和所有列属性的哈希, 哈希相同的表直接跳过;
+    # 不同时再逐列比较, 只是列的顺序或者属性值的类型不同时不会报告差异
+    return hash((table.comment or '', tuple(map(column_key, table.columns))))
+
+
+def diff_table(old, new):
+    """
+    比较同名的两张表, 返回注释以及新增、删除、修改的列
+    """
+    old_columns = {c.name: c for c in old.columns}
+    new_columns = {c.name: c for c in new.columns}
+    result = {'name': new.name}
+    if (old.comment or '') != (new.comment or ''):
+        result['comment'] = [old.comment, new.comment]
+    result['added_columns'] = [{field: getattr(c, field) for field in SNAPSHOT_COLUMN_FIELDS}
+                               for name, c in new_columns.items() if name not in old_columns]
+    result['dropped_columns'] = [name for name in old_columns if name not in new_columns]
+    result['altered_columns'] = []
+    for name, c in new_columns.items():
+        o = old_columns.get(name)
+        if o is None:
+            continue
+        changes = {field: [getattr(o, field), getattr(c, field)]
+                   for field, a, b in zip(DIFF_COLUMN_FIELDS, column_signature(o), column_signature(c)) if a != b}
+        if changes:
+            result['altered_columns'].append({'name': name, 'changes': changes})
+    return result
+
+
+def diff_db(source, target):
+    """
+    比较两个数据库结构, 返回 target 相对 source 新增、删除、修改的表
+    """
+    source_tables = {table.name: table for table in source.tables}
+    target_tables = {table.name: table for table in target.tables}
+    altered = []
+    for name, table in target_tables.items():
+        old = source_tables.get(name)
+        if old is not None and table_signature(old) != table_signature(table):
+            changes = diff_table(old, table)
+            if ('comment' in changes or changes['added_columns'] or changes['dropped_columns']
+                    or changes['altered_columns']):
+                altered.append(changes)
+    return {
+        'source': source.name,
+        'target': target.name,
+        'added_tables': [{'name': table.name, 'comment': table.comment,
+                          'columns': [{field: getattr(c, field) for field in SNAPSHOT_COLUMN_FIELDS} for c in table.columns]}
+                         for name, table in target_tables.items() if name not in source_tables],
+        'dropped_tables': [name for name in source_tables if name not in target_tables],
+        'altered_tables': altered,
+    }
+
+
+def write_diff_text(f, diff):
+    f.write(f"--- {diff['source']}\n+++ {diff['target']}\n")
+    for table in diff['added_tables']:
+        f.write(f"+ 表 {table['name']} ({table['comment'] or ''}), {len(table['columns'])} 列\n")
+    for name in diff['dropped_tables']:
+        f.write(f"- 表 {name}\n")
+    for table in diff['altered_tables']:
+        f.write(f"~ 表 {table['name']}\n")
+        if 'comment' in table:
+            f.write(f"    注释: {table['comment'][0]!r} -> {table['comment'][1]!r}\n")
+        for c in table['added_columns']:
+            f.write(f"    + 列 {c['name']} {c['type']}\n")
+        for name in table['dropped_columns']:
+            f.write(f"    - 列 {name}\n")
+        for c in table['altered_columns']:
+            changes = ', '.join(f"{field}: {old!r} -> {new!r}" for field, (old, new) in c['changes'].items())
+            f.write(f"    ~ 列 {c['name']}: {changes}\n")
+    f.write(f"新增表 {len(diff['added_tables'])} 张, 删除表 {len(diff['dropped_tables'])} 张, "
+            f"修改表 {len(diff['altered_tables'])} 张\n")
+
+
+def read_diff_target(spec, user, password, schema, include, exclude, bulk, stream):
+    """
+    读取 diff 的一端, jdbc url 连接数据库读取, 否则作为快照文件读取
+    """
+    if spec.startswith('jdbc:'):
+        dbtype, host, port, database = parse_jdbc(spec)
+        # 两端同时读取, 进度日志行带上各自的 jdbc url
+        with progress.task(spec):
+            return read_db(dbtype, host, port, user, password, database, schema, include, exclude, bulk,
+                           stream=stream)
+    return load_snapshot(spec, include, exclude)
+
+
+@cli.command(name='diff')
+@click.pass_context
+@argument('source')
+@argument('target')
+@option("--user", "-u", help="database user of jdbc urls")
+@option("--password", "-pwd", help="database password of jdbc urls")
+@option("--schema", "-s", help="database schema of jdbc urls")
+@option("--target-user", help="database user of the target, defaults to --user")
+@option("--target-password", help="database password of the target, defaults to --password")
+@option("--target-schema", help="database schema of the target, defaults to --schema")
+@option("--include", help="include tables support regex", multiple=True)
+@option("--exclude", help="exclude tables support regex", multiple=True)
+@option("--bulk/--no-bulk", help="read table metadata from the catalog in bulk", default=True, show_default=True)
+@option("--stream", help="read bulk catalog queries through server-side cursors in batches", is_flag=True, default=False)
+@option("--format", "fmt", help="output format", type=click.Choice(['text', 'json']), default='text', show_default=True)
+@option("--output", "-o", help="output file, console for stdout", default='console', show_default=True)
+@option("--exit-code", help="exit with 1 if the schemas are different", is_flag=True, default=False)
+def db_diff(ctx, source, target, user, password, schema, target_user, target_password, target_schema, include, exclude,
+            bulk, stream, fmt, output, exit_code):
+    """
+    比较两个数据库(jdbc url)或快照文件的表结构
+    """
+    sides = [[source, user, password, schema],
+             [target, target_user or user, target_password or password, target_schema or schema]]
+    for side in sides:
+        if side[0].startswith('jdbc:'):
+            import survey
+
+            # 两端同时读取, 需要在开始之前补全用户名密码
+            if not side[1]:
+                side[1] = survey.routines.input(f"请输入 {side[0]} 的用户名: ")
+            if not side[2]:
+                side[2] = survey.routines.conceal(f"请输入 {side[0]} 的密码: ")
+        elif not os.path.exists(side[0]):
+            raise click.ClickException(f"既不是 jdbc url 也不是快照文件: {side[0]}")
+
+    with progress.concurrent(), ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(read_diff_target, *side, include, exclude, bulk, stream) for side in sides]
+        source_db, target_db = [future.result() for future in futures]
+
+    diff = diff_db(source_db, target_db)
+    # 两端的库名通常相同, 输出时使用命令行中的 jdbc url 或快照文件名
+    diff.update(source=source, target=target)
+    write = write_diff_text if fmt == 'text' else lambda f, d: f.write(
+        json.dumps(d, ensure_ascii=False, indent=2, default=str) + '\n')
+    if output == 'console':
+        write(sys.stdout, diff)
+        sys.stdout.flush()
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            write(f, diff)
+
+    if exit_code and (diff['added_tables'] or diff['dropped_tables'] or diff['altered_tables']):
+        ctx.exit(1)
+
+
+@cli.command(name='watch')
+@db_options
+@option('--output', '-o', help='output file', default='db-doc.docx', show_default=True)
+@option("--template", help="ms word template file", default="default.docx")
+@option("--format", "fmt", help="document format, the template is only used for docx", type=click.Choice(list(DOC_FORMATS)), default='docx', show_default=True)
+@option("--interval", help="seconds between two checks of the catalog", type=click.FloatRange(min=1), default=60, show_default=True)
+@option("--min-rows", help="skip tables whose estimated row count is below N", type=click.IntRange(min=0), default=0)
+@option("--sort", help="order of the tables, rows and size are estimated from the catalog", type=click.Choice(['name', 'rows', 'size']), default='name', show_default=True)
+@click.pass_context
+def db_watch(ctx, jdbc, dbtype, host, port, user, password, schema, database, include, exclude, bulk, jobs, cache,
+             cache_dir, stream, output, template, fmt, interval, min_rows, sort):
+    """
+    监听表结构变化, 发生变化时重新生成数据库文档
+    """
+    if fmt != 'docx' and ctx.get_parameter_source('output') == click.core.ParameterSource.DEFAULT:
+        output = os.path.splitext(output)[0] + DOC_FORMATS[fmt]
+    output = os.path.abspath(output)
+
+    dbtype, host, port, user, password, database = resolve_connection(jdbc, dbtype, host, port, user, password, database)
+    watch = SchemaWatch(dbtype, host, port, user, password, database, schema, include, exclude)
+    click.echo(f'开始监听表结构: {dbtype} {host}:{port}/{database} -> {output}, 每 {interval:g} 秒检查一次')
+    try:
+        db = watch.load(bulk, jobs, cache_dir if cache else None, stream)
+        ensure_file(output)
+        write_doc(template, output, select_tables(db, min_rows, sort), fmt=fmt)
+        pending = None
+        while True:
+            time.sleep(interval)
+            try:
+                pending = watch.poll() or pending
+            except watch.errors as e:
+                # 连接断开或者查询失败时关闭连接, 下一次轮询重新连接
+                click.echo(f"检查表结构失败, {interval:g} 秒后重试: {str(e).strip()}", err=True)
+                watch.close()
+                continue
+            if pending is not None:
+                if is_file_in_use(output):
+                    click.echo(f"文件: {output} 已被占用, {interval:g} 秒后重试", err=True)
+                    continue
+                write_doc(template, output, select_tables(pending, min_rows, sort), fmt=fmt)
+                pending = None
+    except KeyboardInterrupt:
+        click.echo("停止监听")
+    finally:
+        watch.close()
 
 
 def ensure_file(output):
@@ -563,28 +3187,58 @@ def get_all_tables(cursor):
     return [list(table.values())[0] for table in tables]
 
 
-def get_type(type):
-    # get type info from mysql type use regex
-    return re.match(r'(\w+)(\((\d+)(,(\d+))?\))?', type).groups()[0]
-
+# MySQL 列类型: 基础类型、括号中的参数以及之后的 unsigned/zerofill 等修饰
+MYSQL_TYPE = re.compile(r"\s*(\w*)\s*(?:\((.*)\))?\s*(.*)", re.S)
+# enum/set 的可选值, 值中的单引号写作 ''
+MYSQL_ENUM_VALUE = re.compile(r"'((?:[^']|'')*)'")
 
-def get_length(param):
-    return re.match(r'(\w+)(\((\d+)(,(\d+))?\))?', param).groups()[2]
 
-
-def get_decimal(param):
-    return re.match(r'(\w+)(\((\d+)(,(\d+))?\))?', param).groups()[4]
+@dataclass(frozen=True, slots=True)
+class MysqlType:
+    # 基础类型, 例如 varchar、decimal、enum
+    name: str
+    # 长度或精度
+    length: str | None = None
+    # 小数位数
+    decimal: str | None = None
+    unsigned: bool = False
+    zerofill: bool = False
+    # enum/set 的可选值
+    values: tuple = ()
 
 
+@lru_cache(maxsize=None)
+def parse_mysql_type(column_type):
+    """
+    解析 information_schema.COLUMNS.COLUMN_TYPE 或 show full columns 的 Type, 例如
+    decimal(10,2) unsigned、enum('a','b'); 同一个类型字符串只解析一次
+    """
+    name, args, modifiers = MYSQL_TYPE.match(column_type).groups()
+    length = decimal = None
+    values = ()
+    if name.lower() in ('enum', 'set'):
+        values = tuple(v.replace("''", "'") for v in MYSQL_ENUM_VALUE.findall(args or ''))
+    elif args:
+        # Doris 的 decimalv3(10, 2) 逗号后有空格
+        length, _, decimal = (a.strip() for a in args.partition(','))
+        decimal = decimal or None
+    modifiers = modifiers.lower().split()
+    return MysqlType(intern_str(name), length, decimal, 'unsigned' in modifiers, 'zerofill' in modifiers, values)
+
+
+@profile_table
 def get_all_columns(cursor, table):
     cursor.execute("show full columns from " + table)
     columns = cursor.fetchall()
-    columns_ = [
-        Column(table=table, name=column['Field'], type=get_type(column['Type']), length=get_length(column['Type']),
-               decimal=get_decimal(column['Type']),
-               nullable=column['Null'] == 'YES',
-               default=column['Default'] if column['Default'] is not None else '',
-               comment=column['Comment'] if column['Comment'] is not None else '', ) for column in columns]
+    columns_ = []
+    for column in columns:
+        column_type = parse_mysql_type(column['Type'])
+        columns_.append(
+            Column(table=table, name=column['Field'], type=column_type.name, length=column_type.length,
+                   decimal=column_type.decimal, unsigned=column_type.unsigned, enum_values=column_type.values,
+                   nullable=column['Null'] == 'YES',
+                   default=column['Default'] if column['Default'] is not None else '',
+                   comment=column['Comment'] if column['Comment'] is not None else '', ))
 
     # get primary key
     cursor.execute(f"show index from {table}")
@@ -604,7 +3258,7 @@ def is_file_in_use(filename):
         return False
 
     try:
-        with open(filename, 'w') as file:
+        with open(filename, 'a') as file:
             return False  # 文件未被占用
     except IOError:
         return True  # 文件被占用
@@ -0,0 +1,140 @@
+import importlib.util
+import os
+import shlex
+import sys
+import time
+
+import click
+from click import option
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# shell 中的命令组: 命令前缀 -> 脚本
+TOOLS = {
+    'db': 'db-tool.py',
+    'git': 'git-tool.py',
+    'mvn': 'mvn-tool.py',
+}
+
+
+def load_tool(script):
+    # 脚本名不是合法的模块名, 通过文件路径加载
+    name = os.path.splitext(script)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    # 注册之后 pickle 才能按模块名找到其中的函数, 例如 db doc --render-jobs 提交给子进程的 render_chunk
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def command_words(group):
+    """
+    命令组中每个子命令的选项, 用于自动补全
+    """
+    words = {}
+    for name, command in group.commands.items():
+        options = [opt for param in command.params if isinstance(param, click.Option)
+                   for opt in param.opts + param.secondary_opts]
+        words[name] = options + ['--help']
+    return words
+
+
+def build_completer(tools):
+    from prompt_toolkit.completion import NestedCompleter, WordCompleter
+
+    nested = {name: {command: WordCompleter(options, WORD=True)
+                     for command, options in command_words(module.cli).items()}
+              for name, module in tools.items()}
+    nested.update({'cd': None, 'help': None, 'exit': None})
+    return NestedCompleter.from_nested_dict(nested)
+
+
+def run_line(tools, line):
+    """
+    执行一行输入, 返回 False 表示退出 shell
+    """
+    try:
+        args = shlex.split(line)
+    except ValueError as e:
+        click.echo(f"无法解析输入: {e}", err=True)
+        return True
+    if not args:
+        return True
+
+    name, args = args[0], args[1:]
+    if name in ('exit', 'quit'):
+        return False
+    if name == 'help':
+        for tool, module in tools.items():
+            click.echo(f"{tool:<6}{', '.join(module.cli.commands)}")
+        click.echo("cd DIR 切换工作目录, exit 退出, 命令后加 --help 查看帮助")
+        return True
+    if name == 'cd':
+        try:
+            os.chdir(os.path.expanduser(args[0] if args else '~'))
+        except OSError as e:
+            click.echo(f"无法切换目录: {e}", err=True)
+        return True
+    if name not in tools:
+        click.echo(f"未知命令: {name}, 输入 help 查看可用命令", err=True)
+        return True
+
+    start = time.perf_counter()
+    try:
+        tools[name].cli.main(args=args, prog_name=name, standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+    except click.Abort:
+        click.echo("已取消", err=True)
+    except KeyboardInterrupt:
+        click.echo("已中断", err=True)
+    except Exception as e:
+        # 命令中的异常不影响 shell 本身
+        click.echo(f"命令执行失败: {type(e).__name__}: {e}", err=True)
+    click.echo(f"耗时 {time.perf_counter() - start:.3f} 秒")
+    return True
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@option('--history', help='file to keep the command history', default='~/.dev-auto-history', show_default=True)
+def shell(history):
+    """
+    交互式 shell, 在同一个进程中执行 db、git、mvn 命令, 保留已加载的库、数据库连接、模板和表结构缓存
+    """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+    from prompt_toolkit.history import FileHistory
+
+    tools = {name: load_tool(script) for name, script in TOOLS.items()}
+    db = tools['db']
+    db.CONNECTION_POOL = db.ConnectionPool()
+    db.SNAPSHOT_CACHE = {}
+    db.SESSION_CREDENTIALS = {}
+
+    session = PromptSession(history=FileHistory(os.path.expanduser(history)),
+                            auto_suggest=AutoSuggestFromHistory(),
+                            completer=build_completer(tools))
+    click.echo("输入 help 查看可用命令, exit 或 Ctrl+D 退出")
+    try:
+        while True:
+            try:
+                line = session.prompt(f"{os.path.basename(os.getcwd())}> ")
+            except KeyboardInterrupt:
+                # Ctrl+C 清空当前输入
+                continue
+            except EOFError:
+                break
+            if not run_line(tools, line):
+                break
+    finally:
+        db.CONNECTION_POOL.close()
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,18 +1,17 @@
 import os
-from email.policy import default
+from functools import lru_cache
 
 import click
-import gitlab
-import prompt_toolkit
 from click import option, argument
 
-from git import Repo, InvalidGitRepositoryError
 import survey
-from prompt_toolkit import PromptSession
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.completion import WordCompleter
 import json
 
+import progress
+from progress import PROGRESS_MODES, Progress
+
+# GitPython、python-gitlab 在用到的地方导入, 避免 --help 等命令加载不需要的库
+
 
 def all_branches(repo):
     branches = repo.branches
@@ -21,8 +20,14 @@ def all_branches(repo):
 
 @click.group()
 @option('--repo', '-r', default='.', help='git repository path', type=click.Path(exists=True))
+@option('--progress', 'progress_mode', type=click.Choice(PROGRESS_MODES), default='auto', envvar='DEV_AUTO_PROGRESS',
+        help='progress output: bar on a terminal and log lines otherwise by default', show_default=True)
 @click.pass_context
-def cli(ctx, repo):
+def cli(ctx, repo, progress_mode):
+    from git import Repo, InvalidGitRepositoryError
+
+    progress.MODE = progress_mode
+
     try:
         ctx.obj = Repo(repo)
     except InvalidGitRepositoryError as e:
@@ -312,6 +317,47 @@ def save_config(config):
     with open(config_path, 'w') as f:
         json.dump(config, f, indent=2)
 
+@lru_cache(maxsize=None)
+def gitlab_client(url, token):
+    """
+    同一个 gitlab 地址和 token 只创建一个客户端, 在交互式 shell 中复用其中的 HTTP 连接
+    """
+    import gitlab
+
+    return gitlab.Gitlab(url=url, private_token=token, keep_base_url=True)
+
+
+def clone_progress():
+    """
+    clone 的进度回调, git 输出的每个阶段(计数、压缩、接收、解析差异)对应一个进度
+    """
+    from git import RemoteProgress
+
+    # 阶段 -> (日志中的 phase, 进度条标题)
+    stages = {
+        RemoteProgress.COUNTING: ('clone-counting', '计数对象'),
+        RemoteProgress.COMPRESSING: ('clone-compressing', '压缩对象'),
+        RemoteProgress.RECEIVING: ('clone-receiving', '接收对象'),
+        RemoteProgress.RESOLVING: ('clone-resolving', '解析差异'),
+        RemoteProgress.CHECKING_OUT: ('clone-checkout', '检出文件'),
+    }
+    current = {}
+
+    def update(op_code, cur_count, max_count=None, message=''):
+        stage = op_code & RemoteProgress.OP_MASK
+        if current.get('stage') != stage:
+            if current:
+                current['progress'].close()
+            current.update(stage=stage, progress=Progress(*stages.get(stage, ('clone', '克隆仓库')), unit='个'))
+        current['progress'].update(int(cur_count), int(max_count) if max_count else None,
+                                   message.strip(', ') or None)
+        if op_code & RemoteProgress.END:
+            current.pop('progress').close()
+            current.clear()
+
+    return update
+
+
 @cli.command(name="clone")
 @option('--url', '-u', help='gitlab url')
 @option('--token', '-t', help='gitlab token')
@@ -323,6 +369,8 @@ def clone(ctx, url, token, namespace, dir, ssh):
     """
     从gitlab clone 仓库
     """
+    from git import Repo
+
     # 加载配置
     config = load_config()
     
@@ -342,7 +390,7 @@ def clone(ctx, url, token, namespace, dir, ssh):
         config['gitlab_dir'] = dir
         save_config(config)
 
-    gl = gitlab.Gitlab(url=url, private_token=token, keep_base_url=True)
+    gl = gitlab_client(url, token)
     
     # 搜索项目
     search_term = survey.routines.input("请输入要搜索的仓库名称: ")
@@ -376,7 +424,7 @@ def clone(ctx, url, token, namespace, dir, ssh):
     clone_url = selected_project.ssh_url_to_repo if ssh else selected_project.http_url_to_repo
     click.echo(f"正在克隆仓库 {selected_project.path_with_namespace} 到 {clone_path}")
     click.echo(f"使用{('SSH' if ssh else 'HTTP')}协议: {clone_url}")
-    Repo.clone_from(clone_url, clone_path)
+    Repo.clone_from(clone_url, clone_path, progress=clone_progress())
     click.echo(f"仓库克隆完成")
 
 
@@ -1,11 +1,14 @@
 import glob
 
 import click
-from click import argument
+from click import argument, option
 from lxml import etree
 
 import os
 
+import progress
+from progress import PROGRESS_MODES, Progress
+
 common_dep = [
 
     {
@@ -41,9 +44,12 @@ common_dep = [
 
 @click.group()
 @argument('repo', default='.', type=click.Path(exists=True))
+@option('--progress', 'progress_mode', type=click.Choice(PROGRESS_MODES), default='auto', envvar='DEV_AUTO_PROGRESS',
+        help='progress output: bar on a terminal and log lines otherwise by default', show_default=True)
 @click.pass_context
-def cli(ctx, repo):
+def cli(ctx, repo, progress_mode):
     ctx.obj = repo
+    progress.MODE = progress_mode
 
 
 def all_pom_file(repo):
@@ -51,8 +57,9 @@ def all_pom_file(repo):
     return glob.glob(f'{repo}/**/pom.xml', recursive=True)
 
 
-def add_common_dep(pom):
-    click.echo(f"add common dep to {pom}")
+def add_common_dep(pom, echo=click.echo):
+    # echo: 输出信息的函数, 显示进度条时由进度条清除后再输出
+    echo(f"add common dep to {pom}")
     filtered_dep = []
     #     read pom file with lxml
     tree = etree.parse(pom)
@@ -71,7 +78,7 @@ def add_common_dep(pom):
             #         test if dep is in common_dep
             for common in common_dep:
                 if common['artifactId'] == artifactId.text and common['groupId'] == groupId.text:
-                    click.echo(f"skip {groupId.text}:{artifactId.text}")
+                    echo(f"skip {groupId.text}:{artifactId.text}")
                     break
             else:
                 filtered_dep.append(dep)
@@ -83,7 +90,7 @@ def add_common_dep(pom):
             child.text = v
             dependency.append(child)
         dependencies.append(dependency)
-        click.echo(f"add {dep['groupId']}:{dep['artifactId']}")
+        echo(f"add {dep['groupId']}:{dep['artifactId']}")
     tree.write(pom, pretty_print=True, xml_declaration=True, encoding='UTF-8')
 
 
@@ -94,10 +101,11 @@ def dep(ctx):
     给pom文件中添加常用的依赖
     """
     repo = ctx.obj
-    pom_files = all_pom_file(repo)
-    for pom in pom_files:
-        if '-bussiness' in pom or '-start' in pom:
-            add_common_dep(pom)
+    pom_files = [pom for pom in all_pom_file(repo) if '-bussiness' in pom or '-start' in pom]
+    with Progress('pom', '处理 POM', len(pom_files), '个') as pom_progress:
+        for pom in pom_files:
+            add_common_dep(pom, pom_progress.echo)
+            pom_progress.advance()
 
 
 if __name__ == '__main__':
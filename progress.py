@@ -0,0 +1,173 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+
+# auto: 终端中显示进度条, 否则(例如 CI)定期输出日志行; bar: 进度条; log: 日志行; none: 不输出
+PROGRESS_MODES = ['auto', 'bar', 'log', 'none']
+
+# 当前的输出方式, 由各个脚本的 --progress 选项设置
+MODE = 'auto'
+
+# 进度条的刷新间隔和日志行的输出间隔(秒)
+BAR_INTERVAL = 0.2
+LOG_INTERVAL = float(os.environ.get('DEV_AUTO_PROGRESS_INTERVAL', '10'))
+
+BAR_WIDTH = 30
+
+# 当前线程正在执行的任务名称, 同时执行多个任务时用于区分各自的进度
+_task = threading.local()
+
+
+def resolve_mode(stream=None):
+    if MODE == 'auto':
+        return 'bar' if (stream or sys.stderr).isatty() else 'log'
+    return MODE
+
+
+@contextmanager
+def concurrent():
+    """
+    多个任务同时执行时, 各自的进度条会互相覆盖, 期间把进度条改为日志行
+    """
+    global MODE
+    saved = MODE
+    if resolve_mode() == 'bar':
+        MODE = 'log'
+    try:
+        yield
+    finally:
+        MODE = saved
+
+
+@contextmanager
+def task(name):
+    """
+    在当前线程中创建的进度都带上任务名称, 例如 doc-batch 中的数据库名
+    """
+    saved = getattr(_task, 'name', None)
+    _task.name = name
+    try:
+        yield
+    finally:
+        _task.name = saved
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+
+class Progress:
+    """
+    长时间任务的进度: 完成数量/总数、速度和预计剩余时间, 输出到 stderr
+
+    advance/update 只累加计数并比较时间, 到了刷新间隔才输出, 在循环中调用的开销可以忽略;
+    运行时间不到一个刷新间隔的任务不会有任何输出
+    """
+
+    def __init__(self, phase, title, total=None, unit='', mode=None, stream=None):
+        self.stream = stream or sys.stderr
+        self.mode = mode or resolve_mode(self.stream)
+        self.task = getattr(_task, 'name', None)
+        self.phase = phase
+        self.title = title
+        self.total = total
+        self.unit = unit
+        self.detail = None
+        self.done = 0
+        self.start = time.monotonic()
+        self.interval = BAR_INTERVAL if self.mode == 'bar' else LOG_INTERVAL
+        self.next_output = self.start + self.interval
+        self.written = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def advance(self, n=1):
+        # 多个线程同时调用时计数可能略有偏差, 只影响显示
+        self.done += n
+        if self.mode != 'none':
+            self.tick()
+
+    def update(self, done, total=None, detail=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if detail is not None:
+            self.detail = detail
+        if self.mode != 'none':
+            self.tick()
+
+    def tick(self):
+        now = time.monotonic()
+        if now >= self.next_output and self.lock.acquire(blocking=False):
+            try:
+                self.output(now)
+            finally:
+                self.lock.release()
+
+    def output(self, now):
+        self.next_output = now + self.interval
+        self.written = True
+        elapsed = now - self.start
+        done = min(self.done, self.total) if self.total else self.done
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (self.total - done) / rate if self.total and rate else None
+        if self.mode == 'bar':
+            text = f"\r[{self.task}] {self.title}" if self.task else f"\r{self.title}"
+            if self.total:
+                filled = BAR_WIDTH * done // self.total
+                text += f" [{'#' * filled}{'-' * (BAR_WIDTH - filled)}] {done}/{self.total} {self.unit}"
+            else:
+                text += f" {done} {self.unit}"
+            text += f", {rate:.1f} {self.unit}/秒, 已用 {format_seconds(elapsed)}"
+            if self.total:
+                text += f", 剩余 {format_seconds(eta)}"
+            if self.detail:
+                text += f", {self.detail}"
+            self.stream.write(text + '\x1b[K')
+        else:
+            fields = [('task', self.task and repr(self.task)), ('phase', self.phase), ('done', done), ('total', self.total), ('rate', f"{rate:.1f}"),
+                      ('elapsed', f"{elapsed:.1f}"), ('eta', None if eta is None else f"{eta:.1f}"),
+                      ('detail', self.detail and repr(self.detail))]
+            self.stream.write('progress ' + ' '.join(f"{k}={v}" for k, v in fields if v is not None) + '\n')
+        self.stream.flush()
+
+    def echo(self, message):
+        """
+        输出一行信息, 进度条模式下先清除进度条, 输出之后重新绘制
+        """
+        if self.mode == 'bar' and self.written:
+            self.stream.write('\r\x1b[K')
+            self.stream.flush()
+            click.echo(message)
+            self.output(time.monotonic())
+        else:
+            click.echo(message)
+
+    def close(self):
+        # 只有输出过进度的任务才输出最终结果
+        if self.mode == 'none' or not self.written:
+            return
+        self.output(time.monotonic())
+        if self.mode == 'bar':
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+# 不输出的进度, 作为可选参数的默认值
+NO_PROGRESS = Progress('', '', mode='none')